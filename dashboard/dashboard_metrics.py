@@ -0,0 +1,58 @@
+import pandas as pd
+
+# -------------------------- 看板指标计算（不依赖Streamlit，可单独压测） --------------------------
+FUNNEL_ORDER = ["浏览", "收藏", "加购", "购买"]
+FUNNEL_BEHAVIORS = {"浏览": "pv", "收藏": "fav", "加购": "cart", "购买": "buy"}
+
+
+def calculate_retention(df):
+    """计算用户次日留存率"""
+    if df.empty:
+        return 0.0
+
+    # 提取用户首次行为日期和后续行为日期
+    user_first_date = df.groupby("user_id")["date"].min()
+    user_dates = df.groupby("user_id")["date"].unique()
+
+    # 计算留存用户数
+    retained = 0
+    total = len(user_first_date)
+
+    for user_id, first_date in user_first_date.items():
+        next_day = (pd.to_datetime(first_date) + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+        if next_day in user_dates[user_id]:
+            retained += 1
+
+    return (retained / total) * 100 if total > 0 else 0.0
+
+
+def compute_core_metrics(df):
+    """指标卡片：总用户数、PV、购买量、整体转化率"""
+    total_users = df["user_id"].nunique()
+    total_pv = df[df["behavior_type"] == "pv"].shape[0]
+    total_buy = df[df["behavior_type"] == "buy"].shape[0]
+    conversion = (total_buy / total_pv) * 100 if total_pv > 0 else 0
+    return {
+        "total_users": total_users,
+        "total_pv": total_pv,
+        "total_buy": total_buy,
+        "conversion": conversion,
+    }
+
+
+def compute_funnel_values(df):
+    """转化漏斗各环节独立用户数（按FUNNEL_ORDER排列）"""
+    return [
+        df[df["behavior_type"] == FUNNEL_BEHAVIORS[step]]["user_id"].nunique()
+        for step in FUNNEL_ORDER
+    ]
+
+
+def compute_hourly_behavior(df):
+    """按小时+行为统计次数"""
+    return df.groupby(["hour", "behavior_name"])["user_id"].count().unstack(fill_value=0)
+
+
+def compute_top_categories(df, n):
+    """购买次数最多的前n个品类（Series：品类ID -> 购买次数）"""
+    return df[df["behavior_type"] == "buy"]["category_id"].value_counts().head(n)
@@ -1,17 +1,33 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine
 import plotly.express as px
 import matplotlib.pyplot as plt
 from datetime import datetime
 import warnings
 import os
+import sys
 from textwrap import wrap   # 新增文本换行工具
 from llama_cpp import Llama # 导入Llama相关库
 from translate import Translator
 
 warnings.filterwarnings("ignore")
 
+# 复用scripts目录下的共享模块（数据库连接等）
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+from artifact_cache import CACHE_STATS, memory_cached
+from db import get_engine, read_sql  # 共享连接池，配置见scripts/db.py
+from sqlalchemy import inspect
+from instrumentation import profile_summary, stage
+from sequential_funnel import sequential_funnel
+from settings import RESULTS_DIR
+from topk import (
+    DAILY_CATEGORY_TABLE, DAILY_ITEM_TABLE, DAILY_ITEM_TAIL_TABLE, ITEM_CAPACITY, excluded_upper_bound, merge_topk
+)
+from dashboard_metrics import (
+    FUNNEL_ORDER, calculate_retention, compute_core_metrics, compute_funnel_values,
+    compute_hourly_behavior, compute_top_categories
+)
+
 # -------------------------- PDF导出核心（ReportLab版，支持中文） --------------------------
 from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
@@ -42,7 +58,7 @@ def generate_chinese_pdf(
         return None
     
     # 保存路径（自动创建文件夹）
-    save_path = r"F:\ecommerce-user-behavior-analysis\results\电商用户分析报告.pdf"
+    save_path = os.path.join(RESULTS_DIR, "电商用户分析报告.pdf")
     os.makedirs(os.path.dirname(save_path), exist_ok=True)
     
     # 创建PDF画布（A4尺寸）
@@ -153,33 +169,13 @@ def load_llama_model(model_path):
         st.error(f"模型加载失败：{str(e)}")
         return None
 
-def calculate_retention(df):
-    """计算用户次日留存率"""
-    if df.empty:
-        return 0.0
-    
-    # 提取用户首次行为日期和后续行为日期
-    user_first_date = df.groupby("user_id")["date"].min()
-    user_dates = df.groupby("user_id")["date"].unique()
-    
-    # 计算留存用户数
-    retained = 0
-    total = len(user_first_date)
-    
-    for user_id, first_date in user_first_date.items():
-        next_day = (pd.to_datetime(first_date) + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
-        if next_day in user_dates[user_id]:
-            retained += 1
-    
-    return (retained / total) * 100 if total > 0 else 0.0
-
 def generate_ai_analysis(llm, metrics, df_filtered):
     """使用Llama生成增强版分析建议"""
     if not llm:
         return "AI分析：模型未加载，无法生成分析内容"
     
-    # 提取额外分析维度
-    top_categories = df_filtered[df_filtered["behavior_type"]=="buy"]["category_id"].value_counts().head(3).index.tolist()
+    # 提取额外分析维度（热销品类由页面基于日计数表统一计算后传入）
+    top_categories = metrics["top_categories"]
     user_retention = calculate_retention(df_filtered)
     
     # 计算转化漏斗各环节转化率
@@ -267,21 +263,6 @@ st.set_page_config(page_title="电商用户行为分析看板", layout="wide")
 plt.rcParams["font.sans-serif"] = ["SimSun", "WenQuanYi Micro Hei", "Heiti TC"]
 plt.rcParams["axes.unicode_minus"] = False  # 解决负号显示问题
 
-# -------------------------- MySQL数据库连接 --------------------------
-def get_mysql_engine():
-    MYSQL_CONFIG = {
-        "user": "root",
-        "password": "1111",  # 替换为你的MySQL密码
-        "host": "localhost",
-        "port": 3306,
-        "database": "ecommerce_analysis"
-    }
-    return create_engine(
-        f"mysql+pymysql://{MYSQL_CONFIG['user']}:{MYSQL_CONFIG['password']}@{MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}/{MYSQL_CONFIG['database']}?charset=utf8mb4"
-    )
-
-engine = get_mysql_engine()
-
 # -------------------------- 侧边栏配置 --------------------------
 st.sidebar.header("🔍 筛选条件")
 
@@ -299,6 +280,18 @@ end_date = st.sidebar.date_input(
     max_value=datetime(2017, 12, 3).date()
 )
 
+# 漏斗口径
+st.sidebar.header("🔻 漏斗口径")
+funnel_mode = st.sidebar.radio("统计口径", ["按行为独立统计", "严格顺序（浏览→收藏→加购→购买）"])
+sequential_mode = funnel_mode.startswith("严格顺序")
+window_hours = st.sidebar.number_input(
+    "转化窗口（小时，0表示不限）", min_value=0, max_value=216, value=0, step=1, disabled=not sequential_mode
+)
+funnel_by_label = st.sidebar.selectbox(
+    "按维度判断顺序", ["用户", "用户+商品", "用户+品类"], disabled=not sequential_mode
+)
+funnel_by = {"用户": None, "用户+商品": "item_id", "用户+品类": "category_id"}[funnel_by_label]
+
 # Llama模型配置（纯CPU）
 st.sidebar.header("🤖 AI模型设置")
 model_path = st.sidebar.text_input(
@@ -336,6 +329,15 @@ if 'llm' in st.session_state and st.session_state.llm:
     except AttributeError:
         st.sidebar.text("模型状态：已加载（属性暂不可查）")
 
+# -------------------------- 性能监控 --------------------------
+st.sidebar.header("⏱️ 性能监控")
+profile_enabled = st.sidebar.checkbox("启用cProfile采样", value=False)
+trace_memory_enabled = st.sidebar.checkbox("统计峰值内存（tracemalloc，会明显变慢）", value=False)
+PERF_RECORDS = []  # 本次重跑各阶段的耗时/行数/峰值内存
+
+def perf_stage(name, rows=None):
+    return stage(name, rows=rows, profile=profile_enabled, sink=PERF_RECORDS, trace_memory=trace_memory_enabled)
+
 # -------------------------- 加载筛选后的数据 --------------------------
 @st.cache_data
 def load_behavior_data(start, end):
@@ -343,31 +345,69 @@ def load_behavior_data(start, end):
         SELECT * FROM user_behavior 
         WHERE date >= '{start}' AND date <= '{end}'
     """
-    return pd.read_sql(sql, engine)
+    return read_sql(sql)
+
+@st.cache_data
+def load_daily_buy_counts(start, end):
+    """按天预聚合的品类/商品购买计数（数据清洗时生成），任意日期范围最多合并9天
+
+    库中还没有日计数表（升级后尚未重新运行data_cleaning.py）时返回None
+    """
+    inspector = inspect(get_engine())
+    if not all(inspector.has_table(t) for t in (DAILY_CATEGORY_TABLE, DAILY_ITEM_TABLE, DAILY_ITEM_TAIL_TABLE)):
+        return None
+    where = f"WHERE date >= '{start}' AND date <= '{end}'"
+    category_counts = read_sql(f"SELECT * FROM {DAILY_CATEGORY_TABLE} {where}")
+    item_counts = read_sql(f"SELECT * FROM {DAILY_ITEM_TABLE} {where}")
+    item_tail = read_sql(f"SELECT * FROM {DAILY_ITEM_TAIL_TABLE} {where}")
+    return category_counts, item_counts, item_tail
+
+with perf_stage("加载行为数据") as s:
+    df_filtered = load_behavior_data(start_date, end_date)
+    s["rows"] = df_filtered.shape[0]
+with perf_stage("加载日购买计数") as s:
+    daily_buy_counts = load_daily_buy_counts(start_date, end_date)
+    has_daily_counts = daily_buy_counts is not None
+    if has_daily_counts:
+        daily_category_counts, daily_item_counts, daily_item_tail = daily_buy_counts
+        daily_rows = daily_category_counts.shape[0] + daily_item_counts.shape[0]
+    else:
+        daily_category_counts = daily_item_counts = daily_item_tail = None
+        daily_rows = 0
+    s["rows"] = daily_rows
 
-df_filtered = load_behavior_data(start_date, end_date)
+def merge_top_categories(n):
+    """品类TOP-n：优先合并日计数表，没有日计数表时退回在筛选后的行为数据上计数"""
+    if has_daily_counts:
+        return merge_topk(daily_category_counts, "category_id", n)
+    return compute_top_categories(df_filtered, n).rename_axis("category_id").reset_index(name="buy_count")
 
 # -------------------------- 核心指标展示 --------------------------
 st.title("📊 电商用户行为分析看板")
 st.divider()
 
 # 计算留存率和热销品类
-user_retention = calculate_retention(df_filtered)
-top_categories = df_filtered[df_filtered["behavior_type"]=="buy"]["category_id"].value_counts().head(3).index.tolist()
-
-# 指标卡片（增加留存率指标）
+with perf_stage("留存率计算", rows=df_filtered.shape[0]):
+    user_retention = calculate_retention(df_filtered)
+with perf_stage("指标计算", rows=df_filtered.shape[0]):
+    # 热销品类TOP5图表、PDF中的TOP3和AI提示词共用同一次合并结果
+    top5_categories = merge_top_categories(5)
+    top_categories = top5_categories["category_id"].head(3).tolist()
+
+    # 指标卡片（增加留存率指标）
+    core_metrics = compute_core_metrics(df_filtered)
+    total_users = core_metrics["total_users"]
+    total_pv = core_metrics["total_pv"]
+    total_buy = core_metrics["total_buy"]
+    conversion = core_metrics["conversion"]
 col1, col2, col3, col4, col5 = st.columns(5)
 with col1:
-    total_users = df_filtered["user_id"].nunique()
     st.metric("总独立用户数", value=f"{total_users:,}")
 with col2:
-    total_pv = df_filtered[df_filtered["behavior_type"] == "pv"].shape[0]
     st.metric("总浏览量（PV）", value=f"{total_pv:,}")
 with col3:
-    total_buy = df_filtered[df_filtered["behavior_type"] == "buy"].shape[0]
     st.metric("总购买量", value=f"{total_buy:,}")
 with col4:
-    conversion = (total_buy / total_pv) * 100 if total_pv > 0 else 0
     st.metric("整体转化率", value=f"{conversion:.2f}%")
 with col5:
     st.metric("次日留存率", value=f"{user_retention:.2f}%")
@@ -375,23 +415,25 @@ with col5:
 # -------------------------- 转化漏斗图表 --------------------------
 st.divider()
 st.subheader("转化漏斗分析")
-funnel_data = {
-    "浏览": df_filtered[df_filtered["behavior_type"] == "pv"]["user_id"].nunique(),
-    "收藏": df_filtered[df_filtered["behavior_type"] == "fav"]["user_id"].nunique(),
-    "加购": df_filtered[df_filtered["behavior_type"] == "cart"]["user_id"].nunique(),
-    "购买": df_filtered[df_filtered["behavior_type"] == "buy"]["user_id"].nunique()
-}
-funnel_order = ["浏览", "收藏", "加购", "购买"]
-funnel_values = [funnel_data[s] for s in funnel_order]
-
-fig_funnel = px.funnel(
-    x=funnel_values,
-    y=funnel_order,
-    color=funnel_order,
-    color_discrete_sequence=["#FF6B6B", "#4ECDC4", "#45B7D1", "#96CEB4"],
-    title="用户行为转化漏斗"
-)
-st.plotly_chart(fig_funnel, use_container_width=True)
+funnel_order = FUNNEL_ORDER
+with perf_stage("漏斗图", rows=df_filtered.shape[0]) as s:
+    if sequential_mode:
+        funnel_values = sequential_funnel(
+            df_filtered, window=window_hours * 3600 if window_hours > 0 else None, by=funnel_by
+        )
+    else:
+        funnel_values = compute_funnel_values(df_filtered)
+
+    # 图表按(汇总数据+参数)缓存在内存中，筛选条件未改变结果时不再重建
+    funnel_title = "用户行为转化漏斗（严格顺序）" if sequential_mode else "用户行为转化漏斗"
+    fig_funnel, s["cache_hit"] = memory_cached("funnel", lambda: px.funnel(
+        x=funnel_values,
+        y=funnel_order,
+        color=funnel_order,
+        color_discrete_sequence=["#FF6B6B", "#4ECDC4", "#45B7D1", "#96CEB4"],
+        title=funnel_title
+    ), funnel_values, funnel_order, title=funnel_title)
+    st.plotly_chart(fig_funnel, use_container_width=True)
 
 # -------------------------- 用户分群 + 时段分析 + 热销品类 --------------------------
 st.divider()
@@ -400,49 +442,93 @@ col1, col2, col3 = st.columns(3)  # 增加一列显示热销品类
 
 # RFM用户分群饼图
 with col1:
-    rfm_df = pd.read_sql("SELECT user_segment FROM user_rfm", engine)
-    segment_counts = rfm_df["user_segment"].value_counts()
-    fig_pie = px.pie(
-        values=segment_counts.values,
-        names=segment_counts.index,
-        title="RFM用户分群分布",
-        hole=0.3
-    )
-    st.plotly_chart(fig_pie, use_container_width=True)
+    with perf_stage("RFM分群饼图") as s:
+        # 直接读取分群汇总表（每个分群一行），无需每次刷新都扫描全部用户
+        if inspect(get_engine()).has_table("user_segment_summary"):
+            summary = read_sql("SELECT user_segment, user_count FROM user_segment_summary")
+        else:
+            # 升级后尚未重新运行rfm_analysis.py时还没有汇总表，退回按user_rfm现场计数
+            summary = read_sql("SELECT user_segment, COUNT(*) AS user_count FROM user_rfm GROUP BY user_segment")
+        segment_counts = summary.set_index("user_segment")["user_count"].sort_values(ascending=False)
+        s["rows"] = summary.shape[0]
+        fig_pie, s["cache_hit"] = memory_cached("segment_pie", lambda: px.pie(
+            values=segment_counts.values,
+            names=segment_counts.index,
+            title="RFM用户分群分布",
+            hole=0.3
+        ), segment_counts)
+        st.plotly_chart(fig_pie, use_container_width=True)
 
 # 时段行为分布折线图
 with col2:
-    hourly_behavior = df_filtered.groupby(["hour", "behavior_name"])["user_id"].count().unstack(fill_value=0)
-    fig_hour = px.line(
-        hourly_behavior,
-        x=hourly_behavior.index,
-        y=hourly_behavior.columns,
-        title="用户行为时段分布",
-        labels={"value": "行为次数", "hour": "小时"},
-        markers=True
-    )
-    st.plotly_chart(fig_hour, use_container_width=True)
-    # 提取购买高峰时段
-    if "buy" in hourly_behavior.columns and not hourly_behavior["buy"].empty:
-        buy_peak = hourly_behavior["buy"].idxmax()
-    else:
-        buy_peak = "无数据"
+    with perf_stage("时段分布图", rows=df_filtered.shape[0]) as s:
+        hourly_behavior = compute_hourly_behavior(df_filtered)
+        fig_hour, s["cache_hit"] = memory_cached("hourly_line", lambda: px.line(
+            hourly_behavior,
+            x=hourly_behavior.index,
+            y=hourly_behavior.columns,
+            title="用户行为时段分布",
+            labels={"value": "行为次数", "hour": "小时"},
+            markers=True
+        ), hourly_behavior)
+        st.plotly_chart(fig_hour, use_container_width=True)
+        # 提取购买高峰时段
+        if "buy" in hourly_behavior.columns and not hourly_behavior["buy"].empty:
+            buy_peak = hourly_behavior["buy"].idxmax()
+        else:
+            buy_peak = "无数据"
 
 # 热销品类TOP5柱状图
 with col3:
-    if not df_filtered[df_filtered["behavior_type"] == "buy"].empty:
-        top5_categories = df_filtered[df_filtered["behavior_type"] == "buy"]["category_id"].value_counts().head(5)
-        fig_category = px.bar(
-            x=top5_categories.index.astype(str),
-            y=top5_categories.values,
-            title="热销品类TOP5",
-            labels={"x": "品类ID", "y": "购买次数"},
-            color=top5_categories.values,
-            color_continuous_scale="Viridis"
+    with perf_stage("热销品类图", rows=top5_categories.shape[0]) as s:
+        if not top5_categories.empty:
+            fig_category, s["cache_hit"] = memory_cached("top_categories_bar", lambda: px.bar(
+                x=top5_categories["category_id"].astype(str),
+                y=top5_categories["buy_count"],
+                title="热销品类TOP5",
+                labels={"x": "品类ID", "y": "购买次数"},
+                color=top5_categories["buy_count"],
+                color_continuous_scale="Viridis"
+            ), top5_categories)
+            st.plotly_chart(fig_category, use_container_width=True)
+        else:
+            st.info("该时段内无购买数据，无法展示热销品类")
+
+# -------------------------- 品类/商品TOP-K明细 --------------------------
+st.divider()
+st.subheader("热销品类 & 热销商品 TOP-K")
+top_k = st.slider("展示数量（K）", min_value=5, max_value=50, value=10, step=5)
+with perf_stage("TOP-K明细", rows=daily_rows if has_daily_counts else df_filtered.shape[0]):
+    col1, col2 = st.columns(2)
+    with col1:
+        topk_categories = merge_top_categories(top_k)
+        st.markdown(f"**品类TOP{top_k}（精确计数）**")
+        st.dataframe(
+            topk_categories.rename(columns={"category_id": "品类ID", "buy_count": "购买次数"}),
+            use_container_width=True, hide_index=True
         )
-        st.plotly_chart(fig_category, use_container_width=True)
-    else:
-        st.info("该时段内无购买数据，无法展示热销品类")
+    with col2:
+        if not has_daily_counts:
+            st.info("数据库中还没有商品日购买计数表，请重新运行data_cleaning.py后查看商品TOP-K")
+        else:
+            topk_items = merge_topk(daily_item_counts, "item_id", top_k, tail=daily_item_tail)
+            # 未展示的商品（含每天都没进入保留列表的商品）实际购买次数的上界，购买次数低于它的行排名不确定
+            excluded_bound = excluded_upper_bound(daily_item_counts, "item_id", top_k, daily_item_tail)
+            if not topk_items.empty:
+                topk_items["排名确定"] = topk_items["buy_count"] >= excluded_bound
+            st.markdown(f"**商品TOP{top_k}**")
+            st.dataframe(
+                topk_items.rename(columns={
+                    "item_id": "商品ID", "category_id": "品类ID", "buy_count": "购买次数", "max_error": "最大漏计"
+                }),
+                use_container_width=True, hide_index=True
+            )
+            st.caption(
+                f"商品按天只保留购买最多的{ITEM_CAPACITY}个，「最大漏计」为该商品在未被保留的日期里最多可能少计的次数；"
+                f"未展示的商品实际购买次数最多为{excluded_bound}，购买次数低于该值的行（「排名确定」为否）可能被未展示的商品超过"
+            )
+            if not topk_items.empty and not topk_items["排名确定"].all():
+                st.warning(f"购买次数低于{excluded_bound}的商品排名可能不完整")
 
 # -------------------------- AI分析建议 --------------------------
 st.divider()
@@ -458,6 +544,7 @@ metrics = {
     "conversion": conversion,
     "funnel_values": funnel_values,
     "buy_peak": buy_peak,
+    "top_categories": top_categories,
     "high_value_ratio": (segment_counts.get("高价值用户", 0) / segment_counts.sum() * 100) if segment_counts.sum() > 0 else 0
 }
 
@@ -465,7 +552,8 @@ metrics = {
 ai_analysis = "未生成AI分析"
 if st.session_state.llm:
     with st.spinner("AI正在分析数据（纯CPU，稍慢）..."):
-        ai_analysis = generate_ai_analysis(st.session_state.llm, metrics, df_filtered)
+        with perf_stage("AI分析（Llama）"):
+            ai_analysis = generate_ai_analysis(st.session_state.llm, metrics, df_filtered)
     st.text_area("分析结果", value=ai_analysis, height=200, disabled=True)
 else:
     st.warning("请先加载Llama模型以获取AI分析建议（检查模型路径）")
@@ -477,21 +565,22 @@ st.subheader("📑 报告导出")
 if st.button("生成PDF分析报告"):
     with st.spinner("正在生成PDF报告..."):
         # 准备报告所需数据
-        pdf_path = generate_chinese_pdf(
-            start_date=start_date,
-            end_date=end_date,
-            total_users=total_users,
-            total_pv=total_pv,
-            total_buy=total_buy,
-            conversion=conversion,
-            funnel_order=funnel_order,
-            funnel_values=funnel_values,
-            segment_counts=segment_counts,
-            buy_peak=buy_peak,
-            ai_analysis=ai_analysis,
-            top_categories=top_categories,
-            user_retention=user_retention
-        )
+        with perf_stage("生成PDF"):
+            pdf_path = generate_chinese_pdf(
+                start_date=start_date,
+                end_date=end_date,
+                total_users=total_users,
+                total_pv=total_pv,
+                total_buy=total_buy,
+                conversion=conversion,
+                funnel_order=funnel_order,
+                funnel_values=funnel_values,
+                segment_counts=segment_counts,
+                buy_peak=buy_peak,
+                ai_analysis=ai_analysis,
+                top_categories=top_categories,
+                user_retention=user_retention
+            )
     if pdf_path:
         st.success(f"PDF报告已生成：{pdf_path}")
         # 提供下载功能
@@ -505,6 +594,21 @@ if st.button("生成PDF分析报告"):
     else:
         st.error("PDF报告生成失败")
 
+# -------------------------- 性能监控面板 --------------------------
+with st.sidebar.expander("本次刷新各阶段耗时", expanded=False):
+    perf_df = pd.DataFrame(PERF_RECORDS)
+    if perf_df.empty:
+        st.caption("暂无记录")
+    else:
+        columns = [c for c in ["stage", "seconds", "rows", "peak_mb", "cache_hit"] if c in perf_df.columns]
+        st.dataframe(perf_df[columns], use_container_width=True, hide_index=True)
+        st.caption(f"合计：{perf_df['seconds'].sum():.2f}秒")
+        st.caption(f"图表缓存（自看板启动起）：命中{CACHE_STATS['hits']}次，重建{CACHE_STATS['misses']}次")
+        for record in PERF_RECORDS:
+            if record.get("profile"):
+                st.text(f"[{record['stage']}] cProfile 前15项")
+                st.code(profile_summary(record["profile"]))
+
 # -------------------------- 数据预览 --------------------------
 st.divider()
 with st.expander("📁 查看原始数据（前100行）"):
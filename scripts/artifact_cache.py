@@ -0,0 +1,145 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import types
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from settings import RESULTS_DIR
+
+# -------------------------- 缓存目录 --------------------------
+# 按内容寻址的产物缓存目录：文件名带有(汇总数据+图表参数)的指纹
+CACHE_DIR = os.environ.get("ECOM_CACHE_DIR", os.path.join(RESULTS_DIR, "cache"))
+# 每个产物在磁盘上保留的最近版本数，看板内存中最多缓存的图表数
+CACHE_KEEP = int(os.environ.get("ECOM_CACHE_KEEP", 5))
+MEMORY_CACHE_SIZE = 64
+# ECOM_ARTIFACT_CACHE=0 时不读写缓存，每次都重新渲染（压测渲染耗时时使用）
+CACHE_ENABLED = os.environ.get("ECOM_ARTIFACT_CACHE", "1") == "1"
+
+CACHE_STATS = {"hits": 0, "misses": 0}
+
+_lock = threading.Lock()
+_memory = OrderedDict()
+
+
+# -------------------------- 指纹 --------------------------
+def _update(digest, obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        digest.update(type(obj).__name__.encode())
+        digest.update(repr(list(obj.columns) if isinstance(obj, pd.DataFrame) else obj.name).encode())
+        digest.update(repr(list(obj.dtypes) if isinstance(obj, pd.DataFrame) else obj.dtype).encode())
+        digest.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        digest.update(f"{obj.dtype}{obj.shape}".encode())
+        digest.update(np.ascontiguousarray(obj).tobytes())
+    else:
+        digest.update(json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str).encode("utf8"))
+    digest.update(b"\0")
+
+
+def _update_code(digest, code):
+    """字节码+常量（含嵌套函数），绘图函数里写死的标题、配色、尺寸等改动后指纹随之变化"""
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code(digest, const)
+        elif isinstance(const, frozenset):  # 集合常量的repr顺序随字符串哈希随机化而变化
+            digest.update(repr(sorted(map(repr, const))).encode())
+        else:
+            digest.update(repr(const).encode())
+
+
+def code_fingerprint(fn):
+    digest = hashlib.sha256()
+    _update_code(digest, fn.__code__)
+    return digest.hexdigest()
+
+
+def fingerprint(*parts, **params):
+    """汇总数据（DataFrame/Series/数组/普通值）+图表参数的sha256指纹"""
+    digest = hashlib.sha256()
+    for part in parts:
+        _update(digest, part)
+    _update(digest, params)
+    return digest.hexdigest()
+
+
+def _record(hit):
+    with _lock:
+        CACHE_STATS["hits" if hit else "misses"] += 1
+
+
+# -------------------------- 磁盘产物缓存 --------------------------
+def cached_artifact(filename, render, *data, **params):
+    """数据和参数都未变化时直接复用缓存文件，否则调用render(path)重新生成
+
+    filename：发布到RESULTS_DIR下的文件名（如hourly_behavior.png）
+    render：接收输出路径、负责写出产物的函数，其代码（含写死的图表参数）也计入指纹
+    返回(发布路径, 是否命中缓存)
+    """
+    output_path = os.path.join(RESULTS_DIR, filename)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    if not CACHE_ENABLED:
+        render(output_path)
+        _record(False)
+        return output_path, False
+
+    stem, ext = os.path.splitext(filename)
+    key = fingerprint(filename, code_fingerprint(render), *data, **params)
+    cache_path = os.path.join(CACHE_DIR, f"{stem}-{key[:16]}{ext}")
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    hit = os.path.exists(cache_path)
+    if hit:
+        os.utime(cache_path)  # 刷新修改时间，清理旧版本时按最近使用保留
+    else:
+        # 先写临时文件再改名，并发或中断时不会留下不完整的缓存
+        tmp_path = os.path.join(CACHE_DIR, f".{stem}-{key[:16]}-{os.getpid()}-{threading.get_ident()}{ext}")
+        render(tmp_path)
+        os.replace(tmp_path, cache_path)
+        _prune(stem, ext)
+    _record(hit)
+    shutil.copyfile(cache_path, output_path)
+    return output_path, hit
+
+
+def _prune(stem, ext, keep=CACHE_KEEP):
+    """每个产物只保留最近使用的keep个版本"""
+    paths = glob.glob(os.path.join(CACHE_DIR, f"{glob.escape(stem)}-{'[0-9a-f]' * 16}{ext}"))
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# -------------------------- 内存对象缓存（看板图表） --------------------------
+def memory_cached(name, build, *data, **params):
+    """Streamlit每次交互都会重跑脚本，但导入的模块常驻内存，
+    汇总数据和参数未变化时直接复用上次构建的图表对象
+
+    返回(对象, 是否命中缓存)
+    """
+    if not CACHE_ENABLED:
+        _record(False)
+        return build(), False
+    key = fingerprint(name, code_fingerprint(build), *data, **params)
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            CACHE_STATS["hits"] += 1
+            return _memory[key], True
+    obj = build()
+    with _lock:
+        _memory[key] = obj
+        while len(_memory) > MEMORY_CACHE_SIZE:
+            _memory.popitem(last=False)
+        CACHE_STATS["misses"] += 1
+    return obj, False
@@ -0,0 +1,244 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import delete
+
+import artifact_cache
+import data_cleaning
+import funnel_analysis
+import hourly_analysis
+import instrumentation
+import rfm_analysis
+from artifact_cache import CACHE_STATS
+from db import BACKENDS, DB_BACKEND, read_sql
+from instrumentation import flush
+from sequential_funnel import naive_sequential_funnel, sequential_funnel
+from settings import PROJECT_ROOT, RESULTS_DIR
+from synthetic_data import generate_csv
+from topk import DAILY_CATEGORY_TABLE, merge_topk
+
+# 看板指标计算函数位于dashboard目录
+sys.path.append(os.path.join(PROJECT_ROOT, "dashboard"))
+import dashboard_metrics  # noqa: E402
+
+# -------------------------- 压测配置 --------------------------
+# tracemalloc会显著拖慢逐行写库等阶段，压测时强制关闭，保证历次记录的耗时可比
+instrumentation.TRACE_MEMORY = False
+# 图表缓存会让重复运行（包括历次压测）跳过渲染，压测时关闭，保证能发现渲染性能回退
+artifact_cache.CACHE_ENABLED = False
+
+DEFAULT_SIZES = [1000000, 10000000, 50000000]
+BENCH_DATA_DIR = os.path.join(PROJECT_ROOT, "data", "benchmark")
+# 每条压测结果一行JSON，追加写入，便于对比历次提交发现性能回退
+RESULTS_PATH = os.path.join(RESULTS_DIR, "benchmark_results.jsonl")
+# 严格顺序漏斗与朴素实现交叉校验的用户数及参数组合（窗口秒数, 分组维度）
+CHECK_SAMPLE_USERS = 2000
+SEQUENTIAL_CHECKS = [(None, None), (3600, None), (86400, "category_id"), (None, "item_id")]
+# 在数据库内执行的典型查询（宽表扫描、GROUP BY、COUNT DISTINCT），用于对比不同存储后端
+BACKEND_QUERIES = {
+    "query_funnel_distinct_users":
+        "SELECT behavior_type, COUNT(DISTINCT user_id) AS users FROM user_behavior GROUP BY behavior_type",
+    "query_hourly_counts":
+        "SELECT hour, behavior_name, COUNT(*) AS cnt FROM user_behavior GROUP BY hour, behavior_name",
+    "query_top_categories":
+        "SELECT category_id, COUNT(*) AS buy_count FROM user_behavior WHERE behavior_type = 'buy' "
+        "GROUP BY category_id ORDER BY buy_count DESC LIMIT 10",
+    "query_date_range":
+        "SELECT * FROM user_behavior WHERE date >= '2017-12-01' AND date <= '2017-12-03'",
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def dataset_path(rows, seed):
+    """按行数+种子缓存合成数据，重复压测不再重新生成"""
+    path = os.path.join(BENCH_DATA_DIR, f"synthetic_{rows}_{seed}.csv")
+    if not os.path.exists(path):
+        print(f"📝 生成{rows:,}行合成数据：{path}")
+        generate_csv(path, rows, seed)
+    return path
+
+
+def timed(fn, repeat=1, verbose=False):
+    """运行fn并返回每次耗时（秒），默认屏蔽脚本自身的打印输出"""
+    seconds = []
+    for _ in range(repeat):
+        sink = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with sink:
+            start = time.perf_counter()
+            fn()
+            seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def dashboard_cases(state):
+    """看板每次重跑时的指标计算（日期范围取全部9天）"""
+    def load():
+        state["df"] = read_sql("SELECT * FROM user_behavior WHERE date >= '2017-11-25' AND date <= '2017-12-03'")
+
+    def top_categories_daily():
+        daily = read_sql(f"SELECT * FROM {DAILY_CATEGORY_TABLE} WHERE date >= '2017-11-25' AND date <= '2017-12-03'")
+        return merge_topk(daily, "category_id", 5)
+
+    return [
+        ("dashboard_load", load),
+        ("dashboard_core_metrics", lambda: dashboard_metrics.compute_core_metrics(state["df"])),
+        ("dashboard_funnel", lambda: dashboard_metrics.compute_funnel_values(state["df"])),
+        ("dashboard_hourly", lambda: dashboard_metrics.compute_hourly_behavior(state["df"])),
+        ("dashboard_top_categories", lambda: dashboard_metrics.compute_top_categories(state["df"], 5)),
+        ("dashboard_top_categories_daily", top_categories_daily),
+        ("dashboard_retention", lambda: dashboard_metrics.calculate_retention(state["df"])),
+    ]
+
+
+def sequential_funnel_cases(state):
+    """严格顺序漏斗：全量向量化耗时 + 抽样用户上与朴素实现的耗时对比和结果校验"""
+    def sample():
+        df = state["df"]
+        users = df["user_id"].drop_duplicates().head(CHECK_SAMPLE_USERS)
+        return df[df["user_id"].isin(users)]
+
+    def check():
+        df = sample()
+        for window, by in SEQUENTIAL_CHECKS:
+            fast = sequential_funnel(df, window=window, by=by)
+            slow = naive_sequential_funnel(df, window=window, by=by)
+            if fast != slow:
+                raise AssertionError(f"严格顺序漏斗结果不一致（window={window}, by={by}）：{fast} != {slow}")
+
+    return [
+        ("sequential_funnel", lambda: sequential_funnel(state["df"])),
+        ("sequential_funnel_24h_by_category", lambda: sequential_funnel(state["df"], window=86400, by="category_id")),
+        ("sequential_funnel_sample", lambda: sequential_funnel(sample())),
+        ("sequential_funnel_naive_sample", lambda: naive_sequential_funnel(sample())),
+        ("sequential_funnel_check", check),
+    ]
+
+
+def backend_query_cases():
+    return [(name, lambda sql=sql: read_sql(sql)) for name, sql in BACKEND_QUERIES.items()]
+
+
+def benchmark_size(rows, seed=42, repeat=1, verbose=False):
+    path = dataset_path(rows, seed)
+    state = {}  # 看板类用例共用一次加载的数据
+    # 写库类阶段只跑一次；分析类阶段可重复多次取最小值
+    cases = [
+        ("clean_data", lambda: data_cleaning.clean_data(path, nrows=None, build_summary=False), 1),
+        ("build_user_summary", data_cleaning.build_user_summary, 1),
+        ("funnel_analysis", funnel_analysis.funnel_analysis, repeat),
+        ("funnel_analysis_chunked", lambda: funnel_analysis.funnel_analysis(chunked=True), repeat),
+        ("hourly_analysis", hourly_analysis.hourly_analysis, repeat),
+        ("hourly_analysis_chunked", lambda: hourly_analysis.hourly_analysis(chunked=True), repeat),
+        ("rfm_analysis", rfm_analysis.rfm_analysis, 1),
+    ] + [
+        (name, fn, repeat)
+        for name, fn in backend_query_cases() + dashboard_cases(state) + sequential_funnel_cases(state)
+    ]
+
+    # RFM增量写回的耗时取决于表中已有的结果，每个数据规模都从空表开始，保证与历次记录可比
+    rfm_analysis.ensure_rfm_tables()
+    with rfm_analysis.engine.begin() as conn:
+        conn.execute(delete(rfm_analysis.RFM_TABLE))
+        conn.execute(delete(rfm_analysis.SEGMENT_SUMMARY_TABLE))
+
+    commit = git_commit()
+    records = []
+    for name, fn, times in cases:
+        hits_before = CACHE_STATS["hits"]
+        seconds = timed(fn, times, verbose)
+        record = {
+            "run_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "backend": DB_BACKEND,
+            "rows": rows,
+            "seed": seed,
+            "case": name,
+            "seconds": seconds,
+            "best_seconds": min(seconds),
+            "cache_hit": CACHE_STATS["hits"] > hits_before,  # 为true说明该项未真正渲染，耗时不可比
+        }
+        print(f"⏱️ [{DB_BACKEND}] {rows:>11,}行  {name:<32}{record['best_seconds']:>10.3f}秒")
+        records.append(record)
+    return records
+
+
+def write_results(records, path=RESULTS_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+# -------------------------- 存储后端对比 --------------------------
+def compare_backends(backends, argv, path=RESULTS_PATH):
+    """每个后端在独立子进程中压测（各脚本在导入时即创建引擎），最后汇总为对比表"""
+    started = datetime.now().isoformat(timespec="seconds")
+    for backend in backends:
+        print(f"\n🚀 存储后端：{backend}")
+        env = dict(os.environ, ECOM_DB_BACKEND=backend, ECOM_TRACE_MEMORY="0", ECOM_ARTIFACT_CACHE="0")
+        subprocess.run([sys.executable, os.path.abspath(__file__)] + argv, env=env, check=True)
+
+    # 取本次对比中每个(后端, 行数, 压测项)的最好耗时
+    best = {}
+    with open(path, encoding="utf8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["run_at"] < started or record.get("backend") not in backends:
+                continue
+            best[(record["rows"], record["case"], record["backend"])] = record["best_seconds"]
+
+    print("\n" + "=" * 30 + " 存储后端对比（秒） " + "=" * 30)
+    print(f"{'行数':<12}{'压测项':<34}" + "".join(f"{backend:>12}" for backend in backends))
+    for rows, case in dict.fromkeys((rows, case) for rows, case, _ in best):
+        cells = "".join(
+            f"{best[(rows, case, backend)]:>12.3f}" if (rows, case, backend) in best else f"{'-':>12}"
+            for backend in backends
+        )
+        print(f"{rows:<12,}{case:<34}{cells}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="基于合成数据的端到端性能压测")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="压测数据行数")
+    parser.add_argument("--seed", type=int, default=42, help="合成数据随机种子")
+    parser.add_argument("--repeat", type=int, default=1, help="分析类阶段重复次数（取最小耗时）")
+    parser.add_argument("--output", default=RESULTS_PATH, help="结果文件（JSON Lines，追加写入）")
+    parser.add_argument("--verbose", action="store_true", help="显示各脚本自身的打印输出")
+    parser.add_argument(
+        "--backends", nargs="+", choices=BACKENDS,
+        help="依次在多个存储后端上压测并输出对比表（默认只压测ECOM_DB_BACKEND指定的后端）"
+    )
+    args = parser.parse_args()
+
+    if args.backends:
+        argv = ["--sizes", *map(str, args.sizes), "--seed", str(args.seed),
+                "--repeat", str(args.repeat), "--output", args.output]
+        if args.verbose:
+            argv.append("--verbose")
+        compare_backends(args.backends, argv, args.output)
+        sys.exit(0)
+
+    all_records = []
+    for rows in args.sizes:
+        all_records.extend(benchmark_size(rows, args.seed, args.repeat, args.verbose))
+    write_results(all_records, args.output)
+    flush()
+    print(f"✅ 压测结果已写入：{args.output}")
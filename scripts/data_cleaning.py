@@ -2,33 +2,44 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from sqlalchemy import create_engine, text
-
-# -------------------------- 关键配置 --------------------------
-MYSQL_CONFIG = {
-    "user": "root",          # MySQL用户名
-    "password": "1111",    # MySQL密码
-    "host": "localhost",     # 本地地址
-    "port": 3306,            # MySQL端口
-    "database": "ecommerce_analysis"  # 数据库名
-}
-
-# 连接MySQL
-engine = create_engine(
-    f"mysql+pymysql://{MYSQL_CONFIG['user']}:{MYSQL_CONFIG['password']}@{MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}/{MYSQL_CONFIG['database']}?charset=utf8mb4"
+from sqlalchemy import BigInteger, Column, DateTime, Integer, MetaData, Table, text
+
+from db import get_engine, upsert_clause
+from instrumentation import flush, instrumented, stage
+from topk import (
+    DAILY_CATEGORY_TABLE, DAILY_ITEM_TABLE, DAILY_ITEM_TAIL_TABLE, daily_category_counts, daily_item_counts
+)
+
+# -------------------------- 数据库连接（共享连接池，后端及配置见db.py） --------------------------
+engine = get_engine()
+
+# 用户汇总表结构（首次运行时自动建表，MySQL/SQLite通用）
+metadata = MetaData()
+USER_SUMMARY_TABLE = Table(
+    "user_summary", metadata,
+    Column("user_id", BigInteger, primary_key=True, autoincrement=False),
+    Column("pv_count", Integer),
+    Column("fav_count", Integer),
+    Column("cart_count", Integer),
+    Column("buy_count", Integer),
+    Column("last_buy_time", DateTime),
 )
 
+# 原始数据路径，替换成你的数据路径，比如D:\ecommerce-user-behavior-analysis\data\user_behavior.csv
+DATA_PATH = "F:\\ecommerce-user-behavior-analysis\\data\\user_behavior.csv"
+
 # -------------------------- 数据清洗核心函数 --------------------------
-def clean_data():
-    # 1. 加载数据（只取前100万行，避免内存溢出）
-    # 替换成你的数据路径，比如D:\ecommerce-user-behavior-analysis\data\user_behavior.csv
-    file_path = "F:\\ecommerce-user-behavior-analysis\\data\\user_behavior.csv"
-    df = pd.read_csv(
-        file_path,
-        nrows=1000000,  # 仅取前100万行
-        names=["user_id", "item_id", "category_id", "behavior_type", "timestamp"],  # 给列命名
-        encoding="utf8"
-    )
+@instrumented()
+def clean_data(file_path=DATA_PATH, nrows=1000000, build_summary=True):
+    # 1. 加载数据（默认只取前100万行，避免内存溢出）
+    with stage("读取CSV") as s:
+        df = pd.read_csv(
+            file_path,
+            nrows=nrows,  # 仅取前nrows行
+            names=["user_id", "item_id", "category_id", "behavior_type", "timestamp"],  # 给列命名
+            encoding="utf8"
+        )
+        s["rows"] = df.shape[0]
 
     # 打印原始数据信息
     print("=== 原始数据 ===")
@@ -37,39 +48,60 @@ def clean_data():
 
     # 2. 清洗数据
     # 2.1 把时间戳转成可读时间（如1511548800 → 2017-11-25 00:00:00）
-    df["time"] = pd.to_datetime(df["timestamp"], unit="s")
-    df["date"] = df["time"].dt.date  # 提取日期（2017-11-25）
-    df["hour"] = df["time"].dt.hour   # 提取小时（0-23）
+    with stage("清洗", rows=df.shape[0]):
+        df["time"] = pd.to_datetime(df["timestamp"], unit="s")
+        df["date"] = df["time"].dt.date  # 提取日期（2017-11-25）
+        df["hour"] = df["time"].dt.hour   # 提取小时（0-23）
 
-    # 2.2 过滤异常时间（只保留2017-11-25至2017-12-03的数据）
-    start_date = datetime(2017, 11, 25).date()
-    end_date = datetime(2017, 12, 3).date()
-    df = df[(df["date"] >= start_date) & (df["date"] <= end_date)]
+        # 2.2 过滤异常时间（只保留2017-11-25至2017-12-03的数据）
+        start_date = datetime(2017, 11, 25).date()
+        end_date = datetime(2017, 12, 3).date()
+        df = df[(df["date"] >= start_date) & (df["date"] <= end_date)]
 
-    # 2.3 过滤无效数据（比如用户ID为空的行）
-    df = df[(df["user_id"].notnull()) & (df["item_id"].notnull())]
+        # 2.3 过滤无效数据（比如用户ID为空的行）
+        df = df[(df["user_id"].notnull()) & (df["item_id"].notnull())]
 
-    # 2.4 把行为类型转成中文（pv→浏览，方便分析）
-    behavior_mapping = {"pv": "浏览", "fav": "收藏", "cart": "加购", "buy": "购买"}
-    df["behavior_name"] = df["behavior_type"].map(behavior_mapping)
+        # 2.4 把行为类型转成中文（pv→浏览，方便分析）
+        behavior_mapping = {"pv": "浏览", "fav": "收藏", "cart": "加购", "buy": "购买"}
+        df["behavior_name"] = df["behavior_type"].map(behavior_mapping)
 
     # 打印清洗后的数据信息
     print("\n=== 清洗后数据 ===")
     print(f"数据行数：{df.shape[0]}")  # 大概98万行（过滤了异常数据）
     print(f"行为类型分布：\n{df['behavior_name'].value_counts()}")
 
-    # 3. 导入MySQL（分块导入，避免卡死）
-    print("\n=== 开始导入MySQL ===")
-    df.to_sql(
-        name="user_behavior",  # 导入到user_behavior表
-        con=engine,            # 连接MySQL的引擎
-        if_exists="replace",   # 如果表有数据，覆盖
-        index=False,           # 不导入索引列
-        chunksize=10000        # 每次导入1万行，分100次完成
-    )
+    # 3. 导入数据库（分块导入，避免卡死）
+    print(f"\n=== 开始导入数据库（{engine.dialect.name}） ===")
+    with stage("导入数据库", rows=df.shape[0]):
+        df.to_sql(
+            name="user_behavior",  # 导入到user_behavior表
+            con=engine,            # 数据库引擎（MySQL或SQLite）
+            if_exists="replace",   # 如果表有数据，覆盖
+            index=False,           # 不导入索引列
+            chunksize=10000        # 每次导入1万行，分100次完成
+        )
     print("✅ user_behavior表导入完成！")
 
-    # 4. 生成用户汇总数据（统计每个用户的浏览/购买次数）
+    # 4. 按天预聚合品类/商品购买次数（看板TOP-K只需合并最多9张日表，不再全量value_counts）
+    with stage("品类/商品日计数", rows=df.shape[0]):
+        write_daily_counts(df)
+    print("✅ 品类/商品日购买计数表导入完成！")
+
+    # 5. 生成用户汇总数据（流水线模式下由summary阶段单独执行）
+    if build_summary:
+        build_user_summary()
+
+# -------------------------- 品类/商品日购买计数 --------------------------
+def write_daily_counts(df):
+    item_counts, item_tail = daily_item_counts(df)
+    daily_category_counts(df).to_sql(DAILY_CATEGORY_TABLE, con=engine, if_exists="replace", index=False)
+    item_counts.to_sql(DAILY_ITEM_TABLE, con=engine, if_exists="replace", index=False)
+    item_tail.to_sql(DAILY_ITEM_TAIL_TABLE, con=engine, if_exists="replace", index=False)
+
+# -------------------------- 用户汇总表 --------------------------
+@instrumented()
+def build_user_summary():
+    # 统计每个用户的浏览/购买次数
     summary_sql = """
     INSERT INTO user_summary (user_id, pv_count, fav_count, cart_count, buy_count, last_buy_time)
     SELECT 
@@ -80,20 +112,23 @@ def clean_data():
         SUM(CASE WHEN behavior_type='buy' THEN 1 ELSE 0 END) AS buy_count,
         MAX(CASE WHEN behavior_type='buy' THEN time ELSE NULL END) AS last_buy_time
     FROM user_behavior
+    WHERE 1=1
     GROUP BY user_id
-    ON DUPLICATE KEY UPDATE
-        pv_count=VALUES(pv_count),
-        fav_count=VALUES(fav_count),
-        cart_count=VALUES(cart_count),
-        buy_count=VALUES(buy_count),
-        last_buy_time=VALUES(last_buy_time);
     """
-    # 执行SQL语句
-    with engine.connect() as conn:
+    # 主键冲突时更新，MySQL与SQLite语法不同（SQLite要求SELECT带WHERE才能识别ON CONFLICT）
+    summary_sql += upsert_clause(
+        engine.dialect.name, ["user_id"], ["pv_count", "fav_count", "cart_count", "buy_count", "last_buy_time"]
+    )
+    # 重新导入的行为数据中已不存在的用户（如换了数据集或行数变少）要从汇总表中删除，否则会残留旧用户
+    stale_sql = "DELETE FROM user_summary WHERE user_id NOT IN (SELECT user_id FROM user_behavior)"
+    # 执行SQL语句（删除与更新在同一事务内）
+    metadata.create_all(engine, checkfirst=True)
+    with engine.begin() as conn:
+        removed = conn.execute(text(stale_sql)).rowcount
         conn.execute(text(summary_sql))
-        conn.commit()
-    print("✅ user_summary表导入完成！")
+    print(f"✅ user_summary表导入完成！（移除已不存在的用户{removed}人）")
 
 # 运行函数
 if __name__ == "__main__":
-    clean_data()
\ No newline at end of file
+    clean_data()
+    flush()
\ No newline at end of file
@@ -0,0 +1,153 @@
+import os
+from functools import lru_cache
+
+import pandas as pd
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from settings import PROJECT_ROOT
+
+# -------------------------- 存储后端 --------------------------
+# mysql：默认，需要本地MySQL服务；sqlite：嵌入式单文件数据库，无需服务端，适合笔记本和CI
+BACKENDS = ("mysql", "sqlite")
+DB_BACKEND = os.environ.get("ECOM_DB_BACKEND", "mysql")
+SQLITE_PATH = os.environ.get("ECOM_SQLITE_PATH", os.path.join(PROJECT_ROOT, "data", "ecommerce_analysis.db"))
+
+# -------------------------- MySQL配置（所有脚本和看板共用） --------------------------
+# 可通过环境变量覆盖，无需再逐个修改各脚本
+MYSQL_CONFIG = {
+    "user": os.environ.get("ECOM_MYSQL_USER", "root"),          # MySQL用户名
+    "password": os.environ.get("ECOM_MYSQL_PASSWORD", "1111"),  # MySQL密码
+    "host": os.environ.get("ECOM_MYSQL_HOST", "localhost"),     # 本地地址
+    "port": int(os.environ.get("ECOM_MYSQL_PORT", 3306)),       # MySQL端口
+    "database": os.environ.get("ECOM_MYSQL_DATABASE", "ecommerce_analysis")  # 数据库名
+}
+
+# -------------------------- 连接池配置 --------------------------
+POOL_CONFIG = {
+    "pool_size": int(os.environ.get("ECOM_DB_POOL_SIZE", 5)),         # 常驻连接数
+    "max_overflow": int(os.environ.get("ECOM_DB_MAX_OVERFLOW", 10)),  # 高峰时额外允许的连接数
+    "pool_recycle": int(os.environ.get("ECOM_DB_POOL_RECYCLE", 3600)),  # 连接最长存活秒数，避开MySQL wait_timeout
+    "pool_pre_ping": True,  # 取连接前先ping，自动剔除已断开的连接
+}
+
+# 流式读取时每块的行数
+DEFAULT_CHUNKSIZE = 100000
+
+
+def mysql_url(config=MYSQL_CONFIG):
+    return (
+        f"mysql+pymysql://{config['user']}:{config['password']}@{config['host']}:{config['port']}"
+        f"/{config['database']}?charset=utf8mb4"
+    )
+
+
+def storage_identity(backend=None):
+    """当前写入的存储目标（后端+数据库位置），供流水线指纹区分不同的库"""
+    backend = backend or DB_BACKEND
+    if backend == "sqlite":
+        return {"backend": backend, "path": os.path.abspath(SQLITE_PATH)}
+    return {
+        "backend": backend,
+        "host": MYSQL_CONFIG["host"],
+        "port": MYSQL_CONFIG["port"],
+        "database": MYSQL_CONFIG["database"],
+    }
+
+
+def sqlite_url(path=SQLITE_PATH):
+    return f"sqlite:///{path}"
+
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    # WAL模式下读写互不阻塞，流水线中写库阶段与并行的分析阶段可同时访问
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def get_engine(backend=None, pool_size=None, max_overflow=None, pool_recycle=None, pool_pre_ping=None):
+    """获取共享引擎（同一后端、同一组连接池参数只创建一次），backend默认取ECOM_DB_BACKEND"""
+    return _create_engine(backend or DB_BACKEND, pool_size, max_overflow, pool_recycle, pool_pre_ping)
+
+
+@lru_cache(maxsize=None)
+def _create_engine(backend, pool_size, max_overflow, pool_recycle, pool_pre_ping):
+    if backend not in BACKENDS:
+        raise ValueError(f"不支持的存储后端：{backend}，可选：{', '.join(BACKENDS)}")
+    if backend == "sqlite":
+        # SQLite是本地文件，不使用MySQL的连接池参数，显式传入时直接报错而不是静默忽略
+        pool_args = {"pool_size": pool_size, "max_overflow": max_overflow, "pool_recycle": pool_recycle,
+                     "pool_pre_ping": pool_pre_ping}
+        given = [name for name, value in pool_args.items() if value is not None]
+        if given:
+            raise ValueError(f"SQLite后端不支持连接池参数：{', '.join(given)}")
+        os.makedirs(os.path.dirname(os.path.abspath(SQLITE_PATH)), exist_ok=True)
+        # 写锁等待最长60秒，避免并发阶段直接报database is locked
+        engine = create_engine(sqlite_url(), connect_args={"timeout": 60})
+        event.listen(engine, "connect", _enable_sqlite_wal)
+        return engine
+
+    options = dict(POOL_CONFIG)
+    for key, value in {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_recycle": pool_recycle,
+        "pool_pre_ping": pool_pre_ping,
+    }.items():
+        if value is not None:
+            options[key] = value
+    return create_engine(mysql_url(), **options)
+
+
+def read_sql(sql, engine=None, **kwargs):
+    """一次性读取完整结果（小结果集）"""
+    return pd.read_sql(sql, con=engine or get_engine(), **kwargs)
+
+
+def stream_sql(sql, chunksize=DEFAULT_CHUNKSIZE, engine=None, **kwargs):
+    """使用服务端游标（PyMySQL的SSCursor）逐块读取，每次只在内存中保留一块DataFrame
+
+    SQLite没有服务端游标，其游标本身就是逐行从文件读取，同样只按块占用内存
+
+    用法：
+        for chunk in stream_sql("SELECT hour, behavior_name FROM user_behavior"):
+            ...  # 对每块做聚合，再合并部分结果
+    """
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        if engine.dialect.supports_server_side_cursors:
+            conn = conn.execution_options(stream_results=True, max_row_buffer=chunksize)
+        for chunk in pd.read_sql(sql, con=conn, chunksize=chunksize, **kwargs):
+            yield chunk
+
+
+def upsert(conn, table, rows, batch_size=10000):
+    """按主键批量插入或更新（rows为dict列表）
+
+    MySQL下为INSERT ... ON DUPLICATE KEY UPDATE，SQLite下为INSERT ... ON CONFLICT DO UPDATE
+    """
+    key_columns = [c.name for c in table.primary_key.columns]
+    update_columns = [c.name for c in table.columns if not c.primary_key]
+    for start in range(0, len(rows), batch_size):
+        if conn.dialect.name == "sqlite":
+            stmt = sqlite_insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=key_columns,
+                set_={name: stmt.excluded[name] for name in update_columns}
+            )
+        else:
+            stmt = mysql_insert(table)
+            stmt = stmt.on_duplicate_key_update({name: stmt.inserted[name] for name in update_columns})
+        conn.execute(stmt, rows[start:start + batch_size])
+
+
+def upsert_clause(dialect_name, key_columns, update_columns):
+    """INSERT ... SELECT语句末尾的按主键更新子句（文本SQL用）"""
+    if dialect_name == "sqlite":
+        assignments = ", ".join(f"{name}=excluded.{name}" for name in update_columns)
+        return f"ON CONFLICT({', '.join(key_columns)}) DO UPDATE SET {assignments}"
+    assignments = ", ".join(f"{name}=VALUES({name})" for name in update_columns)
+    return f"ON DUPLICATE KEY UPDATE {assignments}"
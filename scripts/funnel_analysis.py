@@ -1,31 +1,87 @@
+import argparse
+
+import numpy as np
 import pandas as pd
 import plotly.express as px
-from sqlalchemy import create_engine
-
-# -------------------------- MySQL配置 --------------------------
-MYSQL_CONFIG = {
-    "user": "root",
-    "password": "1111",
-    "host": "localhost",
-    "port": 3306,
-    "database": "ecommerce_analysis"
-}
-engine = create_engine(
-    f"mysql+pymysql://{MYSQL_CONFIG['user']}:{MYSQL_CONFIG['password']}@{MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}/{MYSQL_CONFIG['database']}?charset=utf8mb4"
-)
 
-# -------------------------- 漏斗分析 --------------------------
-def funnel_analysis():
-    # 1. 读取数据
-    df = pd.read_sql("SELECT * FROM user_behavior", con=engine)
-
-    # 2. 计算各环节独立用户数
-    funnel_data = {
-        "浏览": df[df["behavior_type"]=="pv"]["user_id"].nunique(),
-        "收藏": df[df["behavior_type"]=="fav"]["user_id"].nunique(),
-        "加购": df[df["behavior_type"]=="cart"]["user_id"].nunique(),
-        "购买": df[df["behavior_type"]=="buy"]["user_id"].nunique()
+from artifact_cache import cached_artifact
+from db import DEFAULT_CHUNKSIZE, get_engine, stream_sql
+from instrumentation import flush, instrumented, stage
+from sequential_funnel import sequential_funnel
+
+# -------------------------- 数据库连接（共享连接池，后端及配置见db.py） --------------------------
+engine = get_engine()
+
+FUNNEL_STEPS = {"浏览": "pv", "收藏": "fav", "加购": "cart", "购买": "buy"}
+
+# -------------------------- 独立用户计数 --------------------------
+class UserBitmap:
+    """以user_id为下标的布尔位图，用于跨分块合并去重用户
+
+    内存只与最大user_id有关（100万用户约1MB），与行为表行数无关
+    """
+
+    def __init__(self):
+        self.bits = np.zeros(0, dtype=bool)
+
+    def add(self, user_ids):
+        ids = pd.Series(user_ids).dropna().to_numpy(dtype=np.int64)
+        if ids.size == 0:
+            return
+        if ids.min() < 0:
+            raise ValueError("UserBitmap仅支持非负整数user_id")
+        top = int(ids.max())
+        if top >= self.bits.size:
+            grown = np.zeros(max(top + 1, self.bits.size * 2), dtype=bool)
+            grown[:self.bits.size] = self.bits
+            self.bits = grown
+        self.bits[ids] = True
+
+    def count(self):
+        return int(self.bits.sum())
+
+
+def count_funnel_users(df):
+    """内存模式：各环节独立用户数"""
+    return {
+        step: df[df["behavior_type"]==behavior]["user_id"].nunique()
+        for step, behavior in FUNNEL_STEPS.items()
     }
+
+
+def count_funnel_users_chunked(chunksize=DEFAULT_CHUNKSIZE):
+    """分块模式：流式读取行为数据，每个环节用位图合并各块的独立用户"""
+    bitmaps = {step: UserBitmap() for step in FUNNEL_STEPS}
+    with stage("分块读取", rows=0) as s:
+        for chunk in stream_sql("SELECT user_id, behavior_type FROM user_behavior", chunksize=chunksize):
+            for step, behavior in FUNNEL_STEPS.items():
+                bitmaps[step].add(chunk.loc[chunk["behavior_type"]==behavior, "user_id"])
+            s["rows"] += chunk.shape[0]
+    return {step: bitmap.count() for step, bitmap in bitmaps.items()}
+
+# -------------------------- 漏斗分析 --------------------------
+@instrumented()
+def funnel_analysis(df=None, chunked=False, chunksize=DEFAULT_CHUNKSIZE, sequential=False, window=None, by=None):
+    # 1+2. 计算各环节独立用户数
+    # 流水线可传入已加载的行为数据避免重复读表；chunked=True时分块流式读取，内存占用与表大小无关
+    # sequential=True时按严格顺序口径统计（需同一用户按时间依次完成各步，window为转化窗口秒数，by为商品/品类维度）
+    if sequential and chunked:
+        raise ValueError("严格顺序漏斗需要按用户排序的完整行为序列，不支持分块模式")
+    with stage("统计") as s:
+        if sequential:
+            if df is None:
+                columns = "user_id, behavior_type, timestamp" + (f", {by}" if by else "")
+                df = pd.read_sql(f"SELECT {columns} FROM user_behavior", con=engine)
+            values = sequential_funnel(df, window=window, by=by)
+            funnel_data = dict(zip(FUNNEL_STEPS, values))
+            s["rows"] = df.shape[0]
+        elif chunked:
+            funnel_data = count_funnel_users_chunked(chunksize)
+        else:
+            if df is None:
+                df = pd.read_sql("SELECT user_id, behavior_type FROM user_behavior", con=engine)
+            funnel_data = count_funnel_users(df)
+            s["rows"] = df.shape[0]
     funnel_order = ["浏览", "收藏", "加购", "购买"]
     funnel_values = [funnel_data[step] for step in funnel_order]
 
@@ -35,24 +91,32 @@ def funnel_analysis():
         rate = (funnel_values[i] / funnel_values[i-1]) * 100
         conversion_rates.append(f"{rate:.2f}%")
 
-    # 4. 绘制漏斗图（保存为HTML）
-    fig = px.funnel(
-        x=funnel_values,
-        y=funnel_order,
-        title="电商用户转化漏斗",
-        labels={"x": "独立用户数", "y": "转化环节"}
-    )
-    # 添加转化率标注
-    for i, rate in enumerate(conversion_rates):
-        fig.add_annotation(
-            x=(funnel_values[i] + funnel_values[i+1])/2,
-            y=i+0.5,
-            text=f"转化率：{rate}",
-            showarrow=False
+    # 4. 绘制漏斗图（保存为HTML，各环节人数和标题都未变化时直接复用缓存）
+    title = "电商用户转化漏斗（严格顺序）" if sequential else "电商用户转化漏斗"
+
+    def render(path):
+        fig = px.funnel(
+            x=funnel_values,
+            y=funnel_order,
+            title=title,
+            labels={"x": "独立用户数", "y": "转化环节"}
         )
-    # 保存HTML文件
-    fig.write_html("F:\\ecommerce-user-behavior-analysis\\results\\funnel_analysis.html")
-    print("✅ 漏斗图已保存！")
+        # 添加转化率标注
+        for i, rate in enumerate(conversion_rates):
+            fig.add_annotation(
+                x=(funnel_values[i] + funnel_values[i+1])/2,
+                y=i+0.5,
+                text=f"转化率：{rate}",
+                showarrow=False
+            )
+        # 保存HTML文件
+        fig.write_html(path)
+
+    with stage("绘图") as s:
+        save_path, s["cache_hit"] = cached_artifact(
+            "funnel_analysis.html", render, funnel_values, funnel_order, title=title
+        )
+    print(f"♻️ 漏斗数据未变化，复用缓存的漏斗图：{save_path}" if s["cache_hit"] else f"✅ 漏斗图已保存：{save_path}")
 
     # 5. 输出结论
     print("\n=== 转化漏斗结论 ===")
@@ -63,4 +127,16 @@ def funnel_analysis():
         print("⚠️ 加购→购买转化率低于5%，建议优化下单流程！")
 
 if __name__ == "__main__":
-    funnel_analysis()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="转化漏斗分析")
+    parser.add_argument("--chunked", action="store_true", help="分块流式读取（数据量超过内存时使用）")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="每块行数")
+    parser.add_argument("--sequential", action="store_true", help="严格顺序漏斗：同一用户按时间依次完成浏览→收藏→加购→购买")
+    parser.add_argument("--window-hours", type=float, default=None, help="严格顺序漏斗的转化窗口（小时），默认不限")
+    parser.add_argument("--by", choices=["item_id", "category_id"], default=None, help="严格顺序漏斗按商品/品类分别判断")
+    args = parser.parse_args()
+    window = int(args.window_hours * 3600) if args.window_hours is not None else None
+    funnel_analysis(
+        chunked=args.chunked, chunksize=args.chunksize,
+        sequential=args.sequential, window=window, by=args.by
+    )
+    flush()
\ No newline at end of file
@@ -1,43 +1,70 @@
+import argparse
+
 import pandas as pd
 import matplotlib.pyplot as plt
-from sqlalchemy import create_engine
-
-# -------------------------- MySQL配置 --------------------------
-MYSQL_CONFIG = {
-    "user": "root",
-    "password": "1111",
-    "host": "localhost",
-    "port": 3306,
-    "database": "ecommerce_analysis"
-}
-engine = create_engine(
-    f"mysql+pymysql://{MYSQL_CONFIG['user']}:{MYSQL_CONFIG['password']}@{MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}/{MYSQL_CONFIG['database']}?charset=utf8mb4"
-)
+
+from artifact_cache import cached_artifact
+from db import DEFAULT_CHUNKSIZE, get_engine, stream_sql
+from instrumentation import flush, instrumented, stage
+
+# -------------------------- 数据库连接（共享连接池，后端及配置见db.py） --------------------------
+engine = get_engine()
+
+# -------------------------- 按小时+行为计数 --------------------------
+def count_hourly(df):
+    """内存模式：按小时+行为统计次数"""
+    return df.groupby(["hour", "behavior_name"])["user_id"].count().unstack(fill_value=0)
+
+
+def count_hourly_chunked(chunksize=DEFAULT_CHUNKSIZE):
+    """分块模式：每块单独计数后累加，只在内存中保留24×4的部分结果"""
+    total = None
+    with stage("分块读取", rows=0) as s:
+        for chunk in stream_sql("SELECT hour, behavior_name, user_id FROM user_behavior", chunksize=chunksize):
+            part = chunk.groupby(["hour", "behavior_name"])["user_id"].count()
+            total = part if total is None else total.add(part, fill_value=0)
+            s["rows"] += chunk.shape[0]
+    if total is None:
+        return pd.DataFrame()
+    return total.astype("int64").sort_index().unstack(fill_value=0)
 
 # -------------------------- 时段分析 --------------------------
-def hourly_analysis():
-    # 1. 读取数据
-    df = pd.read_sql("SELECT hour, behavior_name, user_id FROM user_behavior", con=engine)
-
-    # 2. 按小时+行为统计次数
-    hourly_behavior = df.groupby(["hour", "behavior_name"])["user_id"].count().unstack(fill_value=0)
-
-    # 3. 可视化
-    plt.rcParams["font.sans-serif"] = ["SimHei"]
-    plt.rcParams["axes.unicode_minus"] = False
-    plt.figure(figsize=(12, 6))
-    hourly_behavior.plot(kind="line", marker="o", linewidth=2)
-    plt.title("电商用户行为时段分布（小时维度）")
-    plt.xlabel("小时")
-    plt.ylabel("行为次数")
-    plt.xticks(range(0, 24))
-    plt.grid(True, alpha=0.3)
-    plt.legend(title="行为类型")
-    plt.tight_layout()
-    # 保存图片
-    plt.savefig("F:\\ecommerce-user-behavior-analysis\\results\\hourly_behavior.png", dpi=300, bbox_inches="tight")
-    plt.close()
-    print("✅ 时段分析图已保存！")
+@instrumented()
+def hourly_analysis(df=None, chunked=False, chunksize=DEFAULT_CHUNKSIZE):
+    # 1+2. 按小时+行为统计次数
+    # 流水线可传入已加载的行为数据避免重复读表；chunked=True时分块流式读取，内存占用与表大小无关
+    with stage("统计") as s:
+        if chunked:
+            hourly_behavior = count_hourly_chunked(chunksize)
+        else:
+            if df is None:
+                df = pd.read_sql("SELECT hour, behavior_name, user_id FROM user_behavior", con=engine)
+            hourly_behavior = count_hourly(df)
+            s["rows"] = df.shape[0]
+
+    # 3. 可视化（统计结果和图表参数都未变化时直接复用缓存的图片）
+    title = "电商用户行为时段分布（小时维度）"
+    dpi = 300
+
+    def render(path):
+        plt.rcParams["font.sans-serif"] = ["SimHei"]
+        plt.rcParams["axes.unicode_minus"] = False
+        plt.figure(figsize=(12, 6))
+        hourly_behavior.plot(kind="line", marker="o", linewidth=2)
+        plt.title(title)
+        plt.xlabel("小时")
+        plt.ylabel("行为次数")
+        plt.xticks(range(0, 24))
+        plt.grid(True, alpha=0.3)
+        plt.legend(title="行为类型")
+        plt.tight_layout()
+        # 保存图片
+        plt.savefig(path, dpi=dpi, bbox_inches="tight")
+        plt.close()
+
+    with stage("绘图") as s:
+        save_path, s["cache_hit"] = cached_artifact("hourly_behavior.png", render, hourly_behavior, title=title, dpi=dpi)
+    print(f"♻️ 时段数据未变化，复用缓存的时段分析图：{save_path}" if s["cache_hit"] else f"✅ 时段分析图已保存：{save_path}")
 
     # 4. 输出结论
     pv_peak = hourly_behavior["浏览"].idxmax()
@@ -47,4 +74,9 @@ def hourly_analysis():
     print(f"建议：{buy_peak-1}点推送优惠券，提升转化！")
 
 if __name__ == "__main__":
-    hourly_analysis()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="时段行为分析")
+    parser.add_argument("--chunked", action="store_true", help="分块流式读取（数据量超过内存时使用）")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="每块行数")
+    args = parser.parse_args()
+    hourly_analysis(chunked=args.chunked, chunksize=args.chunksize)
+    flush()
\ No newline at end of file
@@ -0,0 +1,173 @@
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+from settings import RESULTS_DIR
+
+# -------------------------- 埋点配置 --------------------------
+# 批处理脚本的阶段耗时以JSON Lines追加写入该文件（默认位于结果目录下，ECOM_RESULTS_DIR可修改）
+METRICS_PATH = os.environ.get("ECOM_METRICS_PATH", os.path.join(RESULTS_DIR, "stage_metrics.jsonl"))
+PROFILE_DIR = os.path.join(RESULTS_DIR, "profiles")
+# ECOM_CPROFILE=1 时对最外层阶段做cProfile采样；ECOM_TRACE_MEMORY=1 时统计峰值内存
+# tracemalloc会跟踪每次内存分配，对逐行写库等场景有数倍的耗时开销，因此默认关闭
+PROFILE_ENABLED = os.environ.get("ECOM_CPROFILE", "0") == "1"
+TRACE_MEMORY = os.environ.get("ECOM_TRACE_MEMORY", "0") == "1"
+
+RUN_ID = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+RECORDS = []  # 本进程尚未写出的阶段记录
+
+_lock = threading.Lock()
+_local = threading.local()
+_tracing = {}  # 线程id -> 该线程中正在统计内存的阶段记录
+_owns_tracemalloc = False  # tracemalloc是否由本模块启动（调用方自己启动的不负责停止）
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def _start_tracing(record):
+    """开始统计内存，返回是否可以重置峰值
+
+    tracemalloc的峰值是进程级的：只有没有其它线程在统计时才重置峰值；
+    与其它线程的阶段重叠时，相关阶段的peak_mb都标记为进程级峰值（peak_scope=process）
+    """
+    global _owns_tracemalloc
+    with _lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _owns_tracemalloc = True
+        me = threading.get_ident()
+        concurrent = any(records for thread, records in _tracing.items() if thread != me)
+        if concurrent:
+            for records in _tracing.values():
+                for r in records:
+                    r["peak_scope"] = "process"
+            record["peak_scope"] = "process"
+        _tracing.setdefault(me, []).append(record)
+        return not concurrent
+
+
+def _stop_tracing(record):
+    global _owns_tracemalloc
+    with _lock:
+        me = threading.get_ident()
+        _tracing[me].remove(record)
+        if not _tracing[me]:
+            del _tracing[me]
+        if not _tracing and _owns_tracemalloc:
+            tracemalloc.stop()
+            _owns_tracemalloc = False
+
+
+# -------------------------- 阶段埋点 --------------------------
+@contextmanager
+def stage(name, rows=None, profile=None, sink=None, trace_memory=None):
+    """记录一个阶段的耗时、处理行数和峰值内存
+
+    用法：
+        with stage("读取数据") as s:
+            df = ...
+            s["rows"] = len(df)
+
+    - 峰值内存基于tracemalloc（NumPy/Pandas的数组分配也会被统计），为该阶段相对开始时新增的峰值；
+      与其它线程的阶段并发时无法区分各线程的分配，记录的是进程级峰值，并带有peak_scope=process标记
+    - profile=True（或ECOM_CPROFILE=1）时对最外层阶段做cProfile采样，结果保存为.prof文件
+    - trace_memory=True（或ECOM_TRACE_MEMORY=1）时统计峰值内存
+    - sink：记录写入的列表，默认写入模块级RECORDS
+    """
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    record = {
+        "run_id": RUN_ID,
+        "stage": name if parent is None else f"{parent['stage']}/{name}",
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "rows": rows,
+    }
+
+    trace_memory = TRACE_MEMORY if trace_memory is None else trace_memory
+    if trace_memory:
+        can_reset = _start_tracing(record)
+        current, peak = tracemalloc.get_traced_memory()
+        # 重置前先把目前为止的峰值记到上层阶段，避免嵌套阶段吞掉外层的峰值
+        if parent is not None and "_peak" in parent:
+            parent["_peak"] = max(parent["_peak"], peak)
+        if can_reset:
+            tracemalloc.reset_peak()
+        record["_base"], record["_peak"] = current, current
+
+    profiler = None
+    if (PROFILE_ENABLED if profile is None else profile) and parent is None:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # 已有其它profiler在运行（如并发阶段）
+            profiler = None
+
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 6)
+        stack.pop()
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{RUN_ID}-{name}.prof".replace("/", "_"))
+            profiler.dump_stats(path)
+            record["profile"] = path
+        if trace_memory:
+            peak = max(record.pop("_peak"), tracemalloc.get_traced_memory()[1])
+            if parent is not None and "_peak" in parent:
+                parent["_peak"] = max(parent["_peak"], peak)
+            record["peak_mb"] = round((peak - record.pop("_base")) / 1024 / 1024, 2)
+            _stop_tracing(record)
+        with _lock:
+            (RECORDS if sink is None else sink).append(record)
+
+
+def instrumented(name=None, rows=None):
+    """装饰器版本：rows可传入函数，根据返回值计算处理行数"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name or fn.__name__) as s:
+                result = fn(*args, **kwargs)
+                if rows is not None:
+                    s["rows"] = rows(result)
+                return result
+        return wrapper
+    return decorator
+
+
+# -------------------------- 结果输出 --------------------------
+def flush(path=METRICS_PATH):
+    """把本进程累积的阶段记录以JSON Lines追加写入文件"""
+    with _lock:
+        records = list(RECORDS)
+        RECORDS.clear()
+    if not records:
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    return path
+
+
+def profile_summary(path, limit=15):
+    """cProfile结果按累计耗时排序的前limit个函数（文本）"""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
@@ -1,128 +1,235 @@
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
-from sqlalchemy import create_engine
 import warnings
 from datetime import datetime
-import os
+from sqlalchemy import (
+    BigInteger, Column, DateTime, Index, Integer, MetaData, String, Table, delete, inspect, select
+)
+
+from artifact_cache import cached_artifact
+from db import get_engine, upsert
+from instrumentation import flush, instrumented, stage
 warnings.filterwarnings("ignore")
 
-# -------------------------- 配置MySQL连接 --------------------------
-MYSQL_CONFIG = {
-    "user": "root",
-    "password": "1111",
-    "host": "localhost",
-    "port": 3306,
-    "database": "ecommerce_analysis"
-}
-engine = create_engine(
-    f"mysql+pymysql://{MYSQL_CONFIG['user']}:{MYSQL_CONFIG['password']}@{MYSQL_CONFIG['host']}:{MYSQL_CONFIG['port']}/{MYSQL_CONFIG['database']}?charset=utf8mb4"
+# -------------------------- 数据库连接（共享连接池，后端及配置见db.py） --------------------------
+engine = get_engine()
+
+# -------------------------- RFM结果表（窄表+索引） --------------------------
+# user_rfm只保留看板/运营需要的列；user_segment_summary是各分群人数，看板饼图直接读取
+metadata = MetaData()
+RFM_TABLE = Table(
+    "user_rfm", metadata,
+    Column("user_id", BigInteger, primary_key=True, autoincrement=False),
+    Column("R", Integer, nullable=False),
+    Column("F", Integer, nullable=False),
+    Column("M", Integer, nullable=False),
+    Column("RFM_score", String(3), nullable=False),
+    Column("user_segment", String(16), nullable=False),
+    Index("idx_user_rfm_segment", "user_segment"),
 )
+SEGMENT_SUMMARY_TABLE = Table(
+    "user_segment_summary", metadata,
+    Column("user_segment", String(16), primary_key=True),
+    Column("user_count", Integer, nullable=False),
+    Column("updated_at", DateTime, nullable=False),
+)
+RFM_COLUMNS = [c.name for c in RFM_TABLE.columns]
+
+
+def ensure_rfm_tables():
+    """建表；旧版整表replace写入的宽表结构不一致时先删除重建（仅首次迁移）"""
+    inspector = inspect(engine)
+    if inspector.has_table(RFM_TABLE.name):
+        existing = {c["name"] for c in inspector.get_columns(RFM_TABLE.name)}
+        if existing != set(RFM_COLUMNS):
+            RFM_TABLE.drop(engine)
+            print("📦 检测到旧版user_rfm宽表，已迁移为窄表结构")
+    metadata.create_all(engine, checkfirst=True)
+
+
+def write_segment_summary(conn, segment_counts):
+    """在调用方的事务内整表刷新分群人数汇总表（每个分群一行）"""
+    now = datetime.now()
+    summary_rows = [
+        {"user_segment": seg, "user_count": int(cnt), "updated_at": now} for seg, cnt in segment_counts.items()
+    ]
+    conn.execute(delete(SEGMENT_SUMMARY_TABLE))
+    if summary_rows:
+        conn.execute(SEGMENT_SUMMARY_TABLE.insert(), summary_rows)
+
+
+def write_rfm_replace(rfm_df, segment_counts, batch_size=10000):
+    """整表覆盖：同一事务内清空后重新插入，表结构仍为窄表，不会出现表缺失"""
+    ensure_rfm_tables()
+    new = rfm_df[RFM_COLUMNS].copy()
+    new["user_id"] = new["user_id"].astype("int64")
+    rows = new.to_dict(orient="records")
+    with engine.begin() as conn:
+        conn.execute(delete(RFM_TABLE))
+        for start in range(0, len(rows), batch_size):
+            conn.execute(RFM_TABLE.insert(), rows[start:start + batch_size])
+        write_segment_summary(conn, segment_counts)
+    return len(rows)
+
+
+def write_rfm_incremental(rfm_df, segment_counts):
+    """与现有user_rfm对比，只写入新增/变化的用户并删除已不存在的用户，同时刷新分群人数汇总表
+
+    所有写入在同一事务内完成，看板读取时始终能看到完整的旧数据或新数据，不会出现表缺失
+    """
+    ensure_rfm_tables()
+    new = rfm_df[RFM_COLUMNS].copy()
+    new["user_id"] = new["user_id"].astype("int64")
+    old = pd.read_sql(select(RFM_TABLE), con=engine)
+
+    merged = new.merge(old, on="user_id", how="left", suffixes=("", "_old"), indicator=True)
+    is_new = merged["_merge"] == "left_only"
+    is_changed = pd.Series(False, index=merged.index)
+    for col in RFM_COLUMNS[1:]:
+        is_changed |= merged[col].astype(str) != merged[f"{col}_old"].astype(str)
+    changed = merged.loc[is_new | is_changed, RFM_COLUMNS]
+    removed = old.loc[~old["user_id"].isin(new["user_id"]), "user_id"].tolist()
+
+    rows = changed.to_dict(orient="records")
+    with engine.begin() as conn:
+        upsert(conn, RFM_TABLE, rows)
+        for start in range(0, len(removed), 10000):
+            conn.execute(delete(RFM_TABLE).where(RFM_TABLE.c.user_id.in_(removed[start:start + 10000])))
+        write_segment_summary(conn, segment_counts)
+
+    stats = {
+        "新增": int(is_new.sum()),
+        "变化": int((is_changed & ~is_new).sum()),
+        "删除": len(removed),
+        "未变化": int(len(new) - len(changed)),
+    }
+    return stats
+
 
 # -------------------------- RFM分析核心 --------------------------
-def rfm_analysis():
+@instrumented()
+def rfm_analysis(write_mode="diff"):
     # 1. 读取用户汇总数据
-    user_summary_df = pd.read_sql("SELECT * FROM user_summary", con=engine)
+    with stage("读取数据") as s:
+        user_summary_df = pd.read_sql("SELECT * FROM user_summary", con=engine)
+        s["rows"] = user_summary_df.shape[0]
     print(f"用户总数：{user_summary_df.shape[0]}")
 
     # 2. 计算RFM指标
-    end_date = datetime(2017, 12, 3).date()
-    # 转换last_buy_time为datetime，空值转NaT
-    user_summary_df["last_buy_time"] = pd.to_datetime(user_summary_df["last_buy_time"], errors="coerce")
+    with stage("打分分群", rows=user_summary_df.shape[0]):
+        end_date = datetime(2017, 12, 3).date()
+        # 转换last_buy_time为datetime，空值转NaT
+        user_summary_df["last_buy_time"] = pd.to_datetime(user_summary_df["last_buy_time"], errors="coerce")
     
-    # 计算R值（最近购买天数，未购买=999）
-    def calc_r_days(row):
-        if pd.notna(row["last_buy_time"]):
-            return (end_date - row["last_buy_time"].date()).days
-        else:
-            return 999
-    user_summary_df["R"] = user_summary_df.apply(calc_r_days, axis=1)
-
-    # F/M值（购买次数，空值填0）
-    user_summary_df["F"] = user_summary_df["buy_count"].fillna(0).astype(int)
-    user_summary_df["M"] = user_summary_df["buy_count"].fillna(0).astype(int)
-
-    # 3. 给RFM打分（核心修复：动态适配分箱数）
-    # 定义打分函数：不管分多少箱，都映射到1-5分
-    def score_rfm(col, ascending=True):
-        # 按值排序，计算百分位
-        rank = col.rank(method="min", ascending=ascending)
-        percent = rank / rank.max()
-        # 按百分位映射到1-5分
-        score = pd.cut(
-            percent,
-            bins=[0, 0.2, 0.4, 0.6, 0.8, 1.0],  # 固定5个区间
-            labels=[5,4,3,2,1] if ascending else [1,2,3,4,5],
-            include_lowest=True
-        )
-        return score
-
-    # R_score：值越小（越近购买），分数越高（5分最好）
-    user_summary_df["R_score"] = score_rfm(user_summary_df["R"], ascending=True)
-    # F/M_score：值越大（购买次数越多），分数越高（5分最好）
-    user_summary_df["F_score"] = score_rfm(user_summary_df["F"], ascending=False)
-    user_summary_df["M_score"] = score_rfm(user_summary_df["M"], ascending=False)
-
-    # 4. 合并分数并分群（处理空值）
-    # 空值填充为"0"，避免字符串拼接失败
-    user_summary_df["R_score"] = user_summary_df["R_score"].astype(str).fillna("0")
-    user_summary_df["F_score"] = user_summary_df["F_score"].astype(str).fillna("0")
-    user_summary_df["M_score"] = user_summary_df["M_score"].astype(str).fillna("0")
-    user_summary_df["RFM_score"] = user_summary_df["R_score"] + user_summary_df["F_score"] + user_summary_df["M_score"]
-
-    # 分群规则
-    def rfm_segment(score):
-        # 高价值：R1-2 + F4-5 + M4-5
-        if (score[0] in ["1","2"]) and (score[1] in ["4","5"]) and (score[2] in ["4","5"]):
-            return "高价值用户"
-        # 潜力用户：R1-2 + F1-3 + M1-3
-        elif (score[0] in ["1","2"]) and (score[1] in ["1","2","3"]) and (score[2] in ["1","2","3"]):
-            return "潜力用户"
-        # 流失高价值：R4-5 + F4-5 + M4-5
-        elif (score[0] in ["4","5"]) and (score[1] in ["4","5"]) and (score[2] in ["4","5"]):
-            return "流失高价值用户"
-        # 低价值：R4-5 + F1-2 + M1-2
-        elif (score[0] in ["4","5"]) and (score[1] in ["1","2"]) and (score[2] in ["1","2"]):
-            return "低价值用户"
-        # 未购买用户
-        elif score.startswith("0"):
-            return "未购买用户"
-        # 一般用户
-        else:
-            return "一般用户"
-    user_summary_df["user_segment"] = user_summary_df["RFM_score"].apply(rfm_segment)
+        # 计算R值（最近购买天数，未购买=999）
+        def calc_r_days(row):
+            if pd.notna(row["last_buy_time"]):
+                return (end_date - row["last_buy_time"].date()).days
+            else:
+                return 999
+        user_summary_df["R"] = user_summary_df.apply(calc_r_days, axis=1)
 
-    # 5. 可视化分群结果
-    plt.rcParams["font.sans-serif"] = ["SimHei"]  # Windows显示中文
-    plt.rcParams["axes.unicode_minus"] = False
-    plt.figure(figsize=(12, 7))
-    
+        # F/M值（购买次数，空值填0）
+        user_summary_df["F"] = user_summary_df["buy_count"].fillna(0).astype(int)
+        user_summary_df["M"] = user_summary_df["buy_count"].fillna(0).astype(int)
+
+        # 3. 给RFM打分（核心修复：动态适配分箱数）
+        # 定义打分函数：不管分多少箱，都映射到1-5分
+        def score_rfm(col, ascending=True):
+            # 按值排序，计算百分位
+            rank = col.rank(method="min", ascending=ascending)
+            percent = rank / rank.max()
+            # 按百分位映射到1-5分
+            score = pd.cut(
+                percent,
+                bins=[0, 0.2, 0.4, 0.6, 0.8, 1.0],  # 固定5个区间
+                labels=[5,4,3,2,1] if ascending else [1,2,3,4,5],
+                include_lowest=True
+            )
+            return score
+
+        # R_score：值越小（越近购买），分数越高（5分最好）
+        user_summary_df["R_score"] = score_rfm(user_summary_df["R"], ascending=True)
+        # F/M_score：值越大（购买次数越多），分数越高（5分最好）
+        user_summary_df["F_score"] = score_rfm(user_summary_df["F"], ascending=False)
+        user_summary_df["M_score"] = score_rfm(user_summary_df["M"], ascending=False)
+
+        # 4. 合并分数并分群（处理空值）
+        # 空值填充为"0"，避免字符串拼接失败
+        user_summary_df["R_score"] = user_summary_df["R_score"].astype(str).fillna("0")
+        user_summary_df["F_score"] = user_summary_df["F_score"].astype(str).fillna("0")
+        user_summary_df["M_score"] = user_summary_df["M_score"].astype(str).fillna("0")
+        user_summary_df["RFM_score"] = user_summary_df["R_score"] + user_summary_df["F_score"] + user_summary_df["M_score"]
+
+        # 分群规则
+        def rfm_segment(score):
+            # 高价值：R1-2 + F4-5 + M4-5
+            if (score[0] in ["1","2"]) and (score[1] in ["4","5"]) and (score[2] in ["4","5"]):
+                return "高价值用户"
+            # 潜力用户：R1-2 + F1-3 + M1-3
+            elif (score[0] in ["1","2"]) and (score[1] in ["1","2","3"]) and (score[2] in ["1","2","3"]):
+                return "潜力用户"
+            # 流失高价值：R4-5 + F4-5 + M4-5
+            elif (score[0] in ["4","5"]) and (score[1] in ["4","5"]) and (score[2] in ["4","5"]):
+                return "流失高价值用户"
+            # 低价值：R4-5 + F1-2 + M1-2
+            elif (score[0] in ["4","5"]) and (score[1] in ["1","2"]) and (score[2] in ["1","2"]):
+                return "低价值用户"
+            # 未购买用户
+            elif score.startswith("0"):
+                return "未购买用户"
+            # 一般用户
+            else:
+                return "一般用户"
+        user_summary_df["user_segment"] = user_summary_df["RFM_score"].apply(rfm_segment)
+
+    # 5. 可视化分群结果（各分群人数未变化时直接复用缓存的饼图）
     # 统计分群数量
     segment_counts = user_summary_df["user_segment"].value_counts()
-    # 绘制饼图（添加颜色和突出效果）
-    colors = ["#FF6B6B", "#4ECDC4", "#45B7D1", "#96CEB4", "#FECA57", "#DDA0DD"]
-    explode = [0.08 if x == "高价值用户" else 0 for x in segment_counts.index]
-    
-    plt.pie(
-        segment_counts.values,
-        labels=segment_counts.index,
-        autopct="%1.1f%%",
-        startangle=90,
-        colors=colors[:len(segment_counts)],
-        explode=explode,
-        textprops={"fontsize": 11}
-    )
-    plt.title("电商用户RFM分群分布", fontsize=16, pad=20)
-    plt.ylabel("")
+    dpi = 300
+
+    def render(path):
+        plt.rcParams["font.sans-serif"] = ["SimHei"]  # Windows显示中文
+        plt.rcParams["axes.unicode_minus"] = False
+        plt.figure(figsize=(12, 7))
+
+        # 绘制饼图（添加颜色和突出效果）
+        colors = ["#FF6B6B", "#4ECDC4", "#45B7D1", "#96CEB4", "#FECA57", "#DDA0DD"]
+        explode = [0.08 if x == "高价值用户" else 0 for x in segment_counts.index]
     
-    # 保存图片
-    save_path = "F:\\ecommerce-user-behavior-analysis\\results\\user_segment_pie.png"
-    plt.savefig(save_path, dpi=300, bbox_inches="tight")
-    plt.close()
-    print(f"✅ 用户分群饼图已保存：{save_path}")
+        plt.pie(
+            segment_counts.values,
+            labels=segment_counts.index,
+            autopct="%1.1f%%",
+            startangle=90,
+            colors=colors[:len(segment_counts)],
+            explode=explode,
+            textprops={"fontsize": 11}
+        )
+        plt.title("电商用户RFM分群分布", fontsize=16, pad=20)
+        plt.ylabel("")
 
-    # 6. 写入MySQL
-    user_summary_df.to_sql("user_rfm", engine, if_exists="replace", index=False)
-    print("✅ RFM结果已写入MySQL -> user_rfm表")
+        # 保存图片
+        plt.savefig(path, dpi=dpi, bbox_inches="tight")
+        plt.close()
+
+    with stage("绘图") as s:
+        save_path, s["cache_hit"] = cached_artifact("user_segment_pie.png", render, segment_counts, dpi=dpi)
+    print(f"♻️ 分群结果未变化，复用缓存的分群饼图：{save_path}" if s["cache_hit"] else f"✅ 用户分群饼图已保存：{save_path}")
+
+    # 6. 写入数据库
+    # diff：增量对比后只写变化的行（默认）；replace：同一事务内清空后全量插入
+    with stage("写入数据库", rows=user_summary_df.shape[0]) as s:
+        if write_mode == "diff":
+            stats = write_rfm_incremental(user_summary_df, segment_counts)
+            s["rows"] = stats["新增"] + stats["变化"] + stats["删除"]
+            print("✅ RFM结果已增量写入数据库 -> user_rfm表（" + "，".join(f"{k}{v}人" for k, v in stats.items()) + "）")
+        elif write_mode == "replace":
+            s["rows"] = write_rfm_replace(user_summary_df, segment_counts)
+            print("✅ RFM结果已写入数据库 -> user_rfm表")
+        else:
+            raise ValueError(f"未知的写入模式：{write_mode}")
 
     # 7. 输出分析结论
     print("\n" + "="*30 + " RFM分析结论 " + "="*30)
@@ -143,12 +250,14 @@ def rfm_analysis():
         print("🚀 潜力用户：推送满减活动，提升购买频次")
 
 if __name__ == "__main__":
-    # 自动创建results文件夹
-    result_dir = "F:\\ecommerce-user-behavior-analysis\\results"
-    if not os.path.exists(result_dir):
-        os.makedirs(result_dir)
-        print(f"📁 已创建文件夹：{result_dir}")
-    
+    parser = argparse.ArgumentParser(description="RFM用户分群分析")
+    parser.add_argument(
+        "--write-mode", choices=["diff", "replace"], default="diff",
+        help="diff：只写入变化的用户（默认）；replace：同一事务内清空后全量写入"
+    )
+    args = parser.parse_args()
+
     # 运行分析
-    rfm_analysis()
+    rfm_analysis(write_mode=args.write_mode)
+    flush()
     print("\n🎉 RFM分析全部完成！")
\ No newline at end of file
@@ -0,0 +1,263 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+from sqlalchemy import inspect
+
+import data_cleaning
+import funnel_analysis
+import hourly_analysis
+import rfm_analysis
+import sequential_funnel
+import topk
+from db import storage_identity
+from instrumentation import flush
+from settings import RESULTS_DIR
+from topk import DAILY_CATEGORY_TABLE, DAILY_ITEM_TABLE, DAILY_ITEM_TAIL_TABLE
+
+# -------------------------- 流水线配置 --------------------------
+# 记录各阶段上次成功运行时的输入指纹，指纹不变则跳过该阶段
+STATE_PATH = os.path.join(RESULTS_DIR, ".pipeline_state.json")
+
+
+# -------------------------- 阶段间共享数据 --------------------------
+class SharedData:
+    """漏斗/时段分析共用同一份行为数据，只从数据库读取一次"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._behavior = None
+
+    def behavior(self):
+        with self._lock:
+            if self._behavior is None:
+                self._behavior = pd.read_sql(
+                    "SELECT user_id, behavior_type, behavior_name, hour FROM user_behavior",
+                    con=data_cleaning.engine
+                )
+            return self._behavior
+
+
+# -------------------------- 阶段定义（DAG） --------------------------
+# deps：依赖的上游阶段；modules：阶段代码所在脚本及其依赖的计算模块（任一代码变动都会使指纹失效）
+# resource：互斥资源，占用同一资源的阶段不会并发执行（pyplot非线程安全）
+# tables/files：阶段产出的数据表和结果文件（相对结果目录），缺失时即使指纹未变也会重新运行
+STAGES = {
+    "ingest": {
+        "deps": [],
+        "modules": [data_cleaning, topk],
+        "tables": ["user_behavior", DAILY_CATEGORY_TABLE, DAILY_ITEM_TABLE, DAILY_ITEM_TAIL_TABLE],
+        "run": lambda ctx: data_cleaning.clean_data(ctx["data_path"], ctx["nrows"], build_summary=False),
+    },
+    "summary": {
+        "deps": ["ingest"],
+        "modules": [data_cleaning],
+        "tables": ["user_summary"],
+        "run": lambda ctx: data_cleaning.build_user_summary(),
+    },
+    "rfm": {
+        "deps": ["summary"],
+        "modules": [rfm_analysis],
+        "resource": "matplotlib",
+        "tables": [rfm_analysis.RFM_TABLE.name, rfm_analysis.SEGMENT_SUMMARY_TABLE.name],
+        "files": ["user_segment_pie.png"],
+        "run": lambda ctx: rfm_analysis.rfm_analysis(),
+    },
+    "funnel": {
+        "deps": ["ingest"],
+        "modules": [funnel_analysis, sequential_funnel],
+        "files": ["funnel_analysis.html"],
+        "run": lambda ctx: (
+            funnel_analysis.funnel_analysis(chunked=True) if ctx["chunked"]
+            else funnel_analysis.funnel_analysis(ctx["shared"].behavior())
+        ),
+    },
+    "hourly": {
+        "deps": ["ingest"],
+        "modules": [hourly_analysis],
+        "resource": "matplotlib",
+        "files": ["hourly_behavior.png"],
+        "run": lambda ctx: (
+            hourly_analysis.hourly_analysis(chunked=True) if ctx["chunked"]
+            else hourly_analysis.hourly_analysis(ctx["shared"].behavior())
+        ),
+    },
+}
+
+
+def topological_order(stages):
+    """按依赖关系排序阶段，发现环则报错"""
+    order, visiting, done = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"阶段依赖存在环：{name}")
+        visiting.add(name)
+        for dep in stages[name]["deps"]:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for name in stages:
+        visit(name)
+    return order
+
+
+# -------------------------- 输入指纹 --------------------------
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def raw_data_fingerprint(ctx):
+    """原始CSV按路径+大小+修改时间计算指纹，避免每次全量哈希大文件"""
+    path = ctx["data_path"]
+    stat = os.stat(path) if os.path.exists(path) else None
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size if stat else None,
+        "mtime": stat.st_mtime if stat else None,
+        "nrows": ctx["nrows"],
+    }
+
+
+def stage_fingerprint(name, ctx, fingerprints):
+    stage = STAGES[name]
+    payload = {
+        "stage": name,
+        "code": [file_digest(module.__file__) for module in stage["modules"]],
+        "upstream": {dep: fingerprints[dep] for dep in stage["deps"]},
+    }
+    if not stage["deps"]:
+        # 换了后端或数据库时，新库中还没有任何数据，下游阶段的指纹也随之失效
+        payload["raw"] = raw_data_fingerprint(ctx)
+        payload["storage"] = storage_identity()
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf8")).hexdigest()
+
+
+def missing_outputs(name):
+    """该阶段应有但当前不存在的数据表/结果文件"""
+    stage = STAGES[name]
+    inspector = inspect(data_cleaning.engine)
+    missing = [table for table in stage.get("tables", []) if not inspector.has_table(table)]
+    missing += [f for f in stage.get("files", []) if not os.path.exists(os.path.join(RESULTS_DIR, f))]
+    return missing
+
+
+def load_state():
+    if os.path.exists(STATE_PATH):
+        with open(STATE_PATH, encoding="utf8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    with open(STATE_PATH, "w", encoding="utf8") as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+
+
+# -------------------------- DAG调度 --------------------------
+def run_pipeline(data_path=data_cleaning.DATA_PATH, nrows=1000000, workers=4, force=False, chunked=False):
+    # chunked=True时漏斗/时段分析各自分块流式读取，不再共享整表数据
+    ctx = {"data_path": data_path, "nrows": nrows, "chunked": chunked, "shared": SharedData()}
+    order = topological_order(STAGES)
+    state = {} if force else load_state()
+    fingerprints = {}
+    results = {}  # 阶段名 -> {"status": ..., "seconds": ...}
+    busy_resources = set()
+    running = {}  # future -> 阶段名
+    pipeline_start = time.perf_counter()
+
+    def run_stage(name):
+        start = time.perf_counter()
+        STAGES[name]["run"](ctx)
+        return time.perf_counter() - start
+
+    def ready(name):
+        if name in results or name in running.values():
+            return False
+        if any(results.get(dep, {}).get("status") not in ("完成", "跳过") for dep in STAGES[name]["deps"]):
+            return False
+        return STAGES[name].get("resource") not in busy_resources
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while len(results) < len(order):
+            # 上游失败的阶段直接标记为阻塞
+            for name in order:
+                if name not in results and any(
+                    results.get(dep, {}).get("status") in ("失败", "阻塞") for dep in STAGES[name]["deps"]
+                ):
+                    results[name] = {"status": "阻塞", "seconds": 0.0}
+
+            for name in order:
+                if not ready(name):
+                    continue
+                fingerprints[name] = stage_fingerprint(name, ctx, fingerprints)
+                if state.get(name) == fingerprints[name]:
+                    missing = missing_outputs(name)
+                    if not missing:
+                        print(f"⏭️ [{name}] 输入未变化，跳过")
+                        results[name] = {"status": "跳过", "seconds": 0.0}
+                        continue
+                    print(f"⚠️ [{name}] 输入未变化但输出缺失（{', '.join(missing)}），重新运行")
+                print(f"▶️ [{name}] 开始运行")
+                resource = STAGES[name].get("resource")
+                if resource:
+                    busy_resources.add(resource)
+                running[pool.submit(run_stage, name)] = name
+
+            if not running:
+                continue
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                busy_resources.discard(STAGES[name].get("resource"))
+                try:
+                    seconds = future.result()
+                except Exception:
+                    traceback.print_exc()
+                    print(f"❌ [{name}] 运行失败")
+                    results[name] = {"status": "失败", "seconds": 0.0}
+                    state.pop(name, None)
+                else:
+                    print(f"✅ [{name}] 完成，耗时{seconds:.2f}秒")
+                    results[name] = {"status": "完成", "seconds": seconds}
+                    state[name] = fingerprints[name]
+                save_state(state)
+
+    print_timing_table(order, results, time.perf_counter() - pipeline_start)
+    # 各脚本内部的细分阶段记录写入stage_metrics.jsonl
+    flush()
+    return results
+
+
+def print_timing_table(order, results, wall_seconds):
+    print("\n" + "=" * 30 + " 阶段耗时 " + "=" * 30)
+    print(f"{'阶段':<10}{'状态':<8}{'耗时(秒)':>10}")
+    for name in order:
+        r = results[name]
+        print(f"{name:<12}{r['status']:<8}{r['seconds']:>12.2f}")
+    total = sum(r["seconds"] for r in results.values())
+    print(f"{'阶段合计':<12}{'':<8}{total:>10.2f}")
+    print(f"{'实际墙钟':<12}{'':<8}{wall_seconds:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="电商用户行为分析流水线：清洗→汇总→RFM，漏斗/时段分析并行执行")
+    parser.add_argument("--data-path", default=data_cleaning.DATA_PATH, help="原始user_behavior.csv路径")
+    parser.add_argument("--nrows", type=int, default=1000000, help="读取的原始数据行数")
+    parser.add_argument("--workers", type=int, default=4, help="并发执行的阶段数")
+    parser.add_argument("--force", action="store_true", help="忽略输入指纹，全部重新运行")
+    parser.add_argument("--chunked", action="store_true", help="漏斗/时段分析分块流式读取（数据量超过内存时使用）")
+    args = parser.parse_args()
+    run_pipeline(args.data_path, args.nrows, args.workers, args.force, args.chunked)
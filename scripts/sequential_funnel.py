@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+# -------------------------- 严格顺序漏斗 --------------------------
+# 原漏斗口径按行为类型分别统计独立用户，没浏览过直接购买的用户也会算进"购买"环节；
+# 严格顺序口径要求同一用户（可选：同一商品/品类内）按时间先后依次完成 浏览→收藏→加购→购买，
+# 后一步的时间不早于前一步（同一秒视为有序），可选转化窗口：从起始浏览到该步不超过window秒
+FUNNEL_SEQUENCE = ["pv", "fav", "cart", "buy"]
+
+
+def sequential_funnel(df, window=None, by=None, steps=FUNNEL_SEQUENCE):
+    """向量化计算严格顺序漏斗，返回每一步到达的独立用户数（与steps等长的列表）
+
+    df需包含user_id, behavior_type, timestamp（秒），按by分组时还需包含该列（item_id/category_id）。
+
+    思路：把(分组, 时间)编码成一个整数键并排序，对每个起始浏览事件，
+    逐步用np.searchsorted找到同组内时间不早于当前步的下一步最早事件。
+    对固定起点，每步取最早事件是最优的；有转化窗口时不同起点结果不同，因此保留全部起点再取最大值，
+    无窗口时只需每组第一个浏览事件。全程没有按用户的Python循环。
+    """
+    if df.empty:
+        return [0] * len(steps)
+
+    keys = ["user_id"] if by is None else ["user_id", by]
+    group_id = df.groupby(keys).ngroup().to_numpy(dtype=np.int64)
+    ts = df["timestamp"].to_numpy(dtype=np.int64)
+    ts = ts - ts.min()
+    span = int(ts.max()) + 1
+    key = group_id * span + ts  # 同组内按时间有序，不同组之间互不重叠
+    behavior = df["behavior_type"].to_numpy()
+
+    # 起点：第一步的事件
+    anchor_key = np.sort(key[behavior == steps[0]])
+    if anchor_key.size == 0:
+        return [0] * len(steps)
+    anchor_group = anchor_key // span
+    if window is None:
+        first = np.concatenate(([True], anchor_group[1:] != anchor_group[:-1]))
+        anchor_key, anchor_group = anchor_key[first], anchor_group[first]
+
+    reached = np.ones(anchor_key.size, dtype=np.int64)  # 每个起点到达的步数
+    alive = np.ones(anchor_key.size, dtype=bool)
+    current = anchor_key
+    for step in steps[1:]:
+        step_key = np.sort(key[behavior == step])
+        if step_key.size == 0:
+            break
+        idx = np.searchsorted(step_key, current, side="left")
+        found = idx < step_key.size
+        next_key = np.where(found, step_key[np.minimum(idx, step_key.size - 1)], 0)
+        ok = alive & found & (next_key // span == anchor_group)
+        if window is not None:
+            ok &= (next_key - anchor_key) <= window
+        alive = ok
+        current = np.where(alive, next_key, current)
+        reached += alive
+        if not alive.any():
+            break
+
+    # 每组取所有起点中的最大步数（起点已按组排序，可直接分段求最大值）
+    starts = np.flatnonzero(np.concatenate(([True], anchor_group[1:] != anchor_group[:-1])))
+    group_stage = np.maximum.reduceat(reached, starts)
+    users = np.empty(group_id.max() + 1, dtype=np.int64)
+    users[group_id] = df["user_id"].to_numpy()
+    group_user = users[anchor_group[starts]]
+
+    # 按商品/品类分组时，用户的进度取其所有分组中的最大值
+    user_stage = pd.Series(group_stage).groupby(group_user).max().to_numpy()
+    return [int((user_stage >= i + 1).sum()) for i in range(len(steps))]
+
+
+# -------------------------- 朴素参考实现（逐用户循环，仅用于校验） --------------------------
+def naive_sequential_funnel(df, window=None, by=None, steps=FUNNEL_SEQUENCE):
+    keys = ["user_id"] if by is None else ["user_id", by]
+    user_stage = {}
+    for group_key, events in df.groupby(keys):
+        user = group_key[0] if isinstance(group_key, tuple) else group_key
+        events = sorted(zip(events["timestamp"], events["behavior_type"]))
+        best = 0
+        for anchor_ts, anchor_behavior in events:
+            if anchor_behavior != steps[0]:
+                continue
+            stage, current = 1, anchor_ts
+            for step in steps[1:]:
+                candidates = [t for t, b in events if b == step and t >= current]
+                if not candidates:
+                    break
+                t = min(candidates)
+                if window is not None and t - anchor_ts > window:
+                    break
+                stage, current = stage + 1, t
+            best = max(best, stage)
+        user_stage[user] = max(user_stage.get(user, 0), best)
+    stages = np.array(list(user_stage.values()), dtype=np.int64)
+    return [int((stages >= i + 1).sum()) for i in range(len(steps))]
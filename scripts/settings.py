@@ -0,0 +1,6 @@
+import os
+
+# -------------------------- 项目路径（各脚本和看板共用） --------------------------
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 图表、HTML、PDF报告、阶段耗时、流水线状态、压测结果等输出目录，可通过环境变量覆盖
+RESULTS_DIR = os.environ.get("ECOM_RESULTS_DIR", os.path.join(PROJECT_ROOT, "results"))
@@ -0,0 +1,112 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# -------------------------- 合成数据配置 --------------------------
+# 与原始UserBehavior.csv相同的5列（无表头）：user_id,item_id,category_id,behavior_type,timestamp
+COLUMNS = ["user_id", "item_id", "category_id", "behavior_type", "timestamp"]
+
+# 行为类型占比（参考原始数据：浏览远多于加购>收藏>购买）
+BEHAVIOR_PROBS = {"pv": 0.895, "cart": 0.055, "fav": 0.029, "buy": 0.021}
+
+# 24小时活跃度（凌晨低谷、午间小高峰、晚间20-22点最高）
+HOUR_PROFILE = np.array([
+    2.6, 1.5, 0.9, 0.6, 0.5, 0.6, 1.0, 1.8, 2.8, 3.5, 4.0, 4.2,
+    4.3, 4.4, 4.3, 4.3, 4.3, 4.2, 4.6, 5.4, 6.4, 7.0, 6.6, 4.4,
+])
+
+# 分析时段2017-11-25至2017-12-03（9天），周末流量略高
+START_TS = 1511568000  # 2017-11-25 00:00:00（UTC，与clean_data的时间转换一致）
+DAY_PROFILE = np.array([1.05, 1.05, 0.95, 0.95, 0.95, 0.95, 1.0, 1.15, 1.15])
+# 少量超出分析时段的脏数据，用于覆盖清洗逻辑
+OUT_OF_RANGE_RATIO = 0.0005
+
+CHUNK_ROWS = 1000000
+
+
+# -------------------------- 长尾分布 --------------------------
+def zipf_weights(n, exponent):
+    """按排名的幂律权重（排名越靠前越热门）"""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def sample_by_weights(rng, cumulative, size):
+    """按累计权重抽样，返回排名下标"""
+    return np.searchsorted(cumulative, rng.random(size) * cumulative[-1], side="right")
+
+
+class SyntheticUserBehavior:
+    """确定性的UserBehavior合成数据生成器（同一参数+seed输出完全相同）"""
+
+    def __init__(self, n_rows, seed=42, n_users=None, n_items=None, n_categories=None):
+        self.n_rows = n_rows
+        self.seed = seed
+        # 默认规模参照原始数据：每用户约100条行为、每商品约25条行为
+        self.n_users = n_users or max(1000, n_rows // 100)
+        self.n_items = n_items or max(1000, n_rows // 25)
+        self.n_categories = n_categories or min(9439, max(100, n_rows // 1000))
+
+        rng = np.random.default_rng(seed)
+        # 打乱排名→ID的映射，避免ID大小与热门程度相关
+        self.user_ids = rng.permutation(self.n_users) + 1
+        self.item_ids = rng.permutation(self.n_items) + 1
+        self.category_ids = rng.permutation(self.n_categories) + 1
+        # 用户活跃度、商品热度、品类热度都是长尾分布
+        self.user_cum = np.cumsum(zipf_weights(self.n_users, 0.6))
+        self.item_cum = np.cumsum(zipf_weights(self.n_items, 1.0))
+        category_cum = np.cumsum(zipf_weights(self.n_categories, 1.1))
+        # 每个商品固定归属一个品类（热门品类下商品也更多）
+        self.item_category = self.category_ids[sample_by_weights(rng, category_cum, self.n_items)]
+
+        self.behaviors = np.array(list(BEHAVIOR_PROBS))
+        self.behavior_cum = np.cumsum(list(BEHAVIOR_PROBS.values()))
+        self.hour_cum = np.cumsum(HOUR_PROFILE / HOUR_PROFILE.sum())
+        self.day_cum = np.cumsum(DAY_PROFILE / DAY_PROFILE.sum())
+
+    def chunks(self, chunk_rows=CHUNK_ROWS):
+        """逐块生成DataFrame，内存只与块大小有关"""
+        for index, start in enumerate(range(0, self.n_rows, chunk_rows)):
+            size = min(chunk_rows, self.n_rows - start)
+            # 每块使用(seed, 块序号)派生的独立随机流，同一参数重复生成结果一致
+            rng = np.random.default_rng([self.seed, index])
+            yield self._make_chunk(rng, size)
+
+    def _make_chunk(self, rng, size):
+        item_rank = sample_by_weights(rng, self.item_cum, size)
+        day = sample_by_weights(rng, self.day_cum, size)
+        hour = sample_by_weights(rng, self.hour_cum, size)
+        timestamp = START_TS + day * 86400 + hour * 3600 + rng.integers(0, 3600, size)
+        dirty = rng.random(size) < OUT_OF_RANGE_RATIO
+        timestamp[dirty] -= rng.integers(2, 30, dirty.sum()) * 86400
+        return pd.DataFrame({
+            "user_id": self.user_ids[sample_by_weights(rng, self.user_cum, size)],
+            "item_id": self.item_ids[item_rank],
+            "category_id": self.item_category[item_rank],
+            "behavior_type": self.behaviors[sample_by_weights(rng, self.behavior_cum, size)],
+            "timestamp": timestamp,
+        }, columns=COLUMNS)
+
+    def to_csv(self, path, chunk_rows=CHUNK_ROWS):
+        """写出与原始数据相同格式的CSV（无表头）"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf8", newline="") as f:
+            for chunk in self.chunks(chunk_rows):
+                chunk.to_csv(f, header=False, index=False)
+        return path
+
+
+def generate_csv(path, n_rows, seed=42):
+    return SyntheticUserBehavior(n_rows, seed=seed).to_csv(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成合成UserBehavior数据（格式同user_behavior.csv）")
+    parser.add_argument("--rows", type=int, default=1000000, help="生成行数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--out", default=os.path.join("data", "synthetic_user_behavior.csv"), help="输出CSV路径")
+    args = parser.parse_args()
+    generate_csv(args.out, args.rows, args.seed)
+    print(f"✅ 已生成{args.rows:,}行合成数据：{args.out}")
@@ -0,0 +1,78 @@
+import pandas as pd
+
+# -------------------------- 按天预聚合的购买计数 --------------------------
+# 品类数量有限（约1万），每天保留全部品类的精确计数；
+# 商品是长尾分布，每天只保留购买次数最多的ITEM_CAPACITY个商品，
+# 同时记录被截掉的商品中最大的购买次数（tail_max），作为合并时的误差上界
+ITEM_CAPACITY = 1000
+
+DAILY_CATEGORY_TABLE = "daily_category_buys"
+DAILY_ITEM_TABLE = "daily_item_buys"
+DAILY_ITEM_TAIL_TABLE = "daily_item_tail"
+
+
+def daily_category_counts(df):
+    """每天每个品类的购买次数：date, category_id, buy_count"""
+    buys = df[df["behavior_type"] == "buy"]
+    return buys.groupby(["date", "category_id"]).size().reset_index(name="buy_count")
+
+
+def daily_item_counts(df, capacity=ITEM_CAPACITY):
+    """每天购买次数TOP capacity的商品，以及被截掉部分的最大购买次数
+
+    返回(counts, tail)：
+    - counts：date, item_id, category_id, buy_count
+    - tail：date, tail_max（当天未保留的商品购买次数都不超过该值，全部保留时为0）
+    """
+    buys = df[df["behavior_type"] == "buy"]
+    counts = buys.groupby(["date", "item_id", "category_id"]).size().reset_index(name="buy_count")
+    counts = counts.sort_values(["date", "buy_count", "item_id"], ascending=[True, False, True])
+    rank = counts.groupby("date").cumcount()
+    tail = (
+        counts[rank >= capacity].groupby("date")["buy_count"].max()
+        .reindex(counts["date"].unique(), fill_value=0)
+        .rename("tail_max").rename_axis("date").reset_index()
+    )
+    return counts[rank < capacity].reset_index(drop=True), tail
+
+
+# -------------------------- 任意日期范围的TOP-K --------------------------
+def merge_topk(daily_counts, key, k, tail=None):
+    """合并若干天的计数表，返回购买次数最多的k个key
+
+    daily_counts：daily_category_counts/daily_item_counts产出的（已按日期筛选的）计数表
+    tail：daily_item_counts产出的截断上界；传入时会给出每个结果的max_error，
+          即该key在未被保留的那几天里最多可能漏计的购买次数
+    """
+    if daily_counts.empty:
+        return pd.DataFrame(columns=[key, "buy_count"])
+    extra = [c for c in daily_counts.columns if c not in ("date", key, "buy_count")]
+    merged = daily_counts.groupby(key).agg(
+        buy_count=("buy_count", "sum"),
+        **{c: (c, "first") for c in extra}
+    ).reset_index()
+    merged = merged.sort_values(["buy_count", key], ascending=[False, True]).head(k)
+    if tail is not None:
+        merged["max_error"] = merged[key].map(max_errors(daily_counts, key, tail)).astype("int64")
+    return merged.reset_index(drop=True)
+
+
+def max_errors(daily_counts, key, tail):
+    """每个key最多可能漏计的购买次数：只在当天被截掉时才可能漏计，即未出现的那些天的tail_max之和"""
+    present = daily_counts[[key, "date"]].drop_duplicates().merge(tail, on="date", how="inner")
+    present_tail = present.groupby(key)["tail_max"].sum()
+    return int(tail["tail_max"].sum()) - present_tail.reindex(daily_counts[key].unique(), fill_value=0)
+
+
+def excluded_upper_bound(daily_counts, key, k, tail):
+    """未进入TOP-k的key实际购买次数的上界
+
+    包括部分天被截掉的key（已计数+最多漏计），以及每天都被截掉、计数表里完全没有的key（各天tail_max之和）。
+    结果中购买次数低于该值的行，排名可能被未保留的key超过，不能视为精确TOP-K
+    """
+    if daily_counts.empty or tail.empty:
+        return 0
+    totals = daily_counts.groupby(key)["buy_count"].sum()
+    upper = totals + max_errors(daily_counts, key, tail).reindex(totals.index, fill_value=0)
+    rest = upper.drop(merge_topk(daily_counts, key, k)[key])
+    return int(max(rest.max() if not rest.empty else 0, tail["tail_max"].sum()))